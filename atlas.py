@@ -0,0 +1,206 @@
+import logging
+import mmap
+import typing
+
+import numpy as np
+
+from config import json_path
+from itemdb import TEXT_FIELDS
+
+ALIGNMENT = 64
+
+# Item keys kept by the records, in slots. The other keys of the item dicts are dropped, the keys set after loading,
+# like the reduced templates of the pyramid search, go to the extra dict of the record.
+SLOT_KEYS = {
+    "slug": "slug",
+    "name": "name",
+    "atk": "atk",
+    "translations": "translations",
+    "itemSet": "item_set",
+    "img": "img",
+    "mask": "mask",
+    "small-img": "small_img",
+    "small-shape": "small_shape",
+    "sift": "sift",
+}
+
+
+class ItemRecord(object):
+    """
+    A loaded item, read like the item dict it was built from. It only keeps what the search and the overlay read :
+    the slug, the texts displayed in one language, and views of its arrays in the catalogue atlas.
+    """
+    __slots__ = tuple(SLOT_KEYS.values()) + ("extra",)
+
+    def __init__(self, item: typing.Dict = None):
+        self.extra = None
+        for key, value in (item or {}).items():
+            self[key] = value
+
+    def __getitem__(self, key):
+        slot = SLOT_KEYS.get(key)
+        if slot is not None:
+            try:
+                return getattr(self, slot)
+            except AttributeError:
+                raise KeyError(key)
+        if self.extra is None:
+            raise KeyError(key)
+        return self.extra[key]
+
+    def __setitem__(self, key, value):
+        slot = SLOT_KEYS.get(key)
+        if slot is not None:
+            setattr(self, slot, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __contains__(self, key):
+        slot = SLOT_KEYS.get(key)
+        if slot is not None:
+            return hasattr(self, slot)
+        return self.extra is not None and key in self.extra
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self) -> typing.List[str]:
+        return [key for key, slot in SLOT_KEYS.items() if hasattr(self, slot)] + list(self.extra or [])
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __repr__(self):
+        return f"ItemRecord({self.slug})"
+
+
+def mapped_buffer(array: np.ndarray) -> typing.Optional[mmap.mmap]:
+    """
+    :return: The memory map the array is a view of, None if it is not a view of a memory map.
+    """
+    while isinstance(array, np.ndarray) and array.base is not None:
+        array = array.base
+    return array if isinstance(array, mmap.mmap) else None
+
+
+class Atlas(object):
+    """
+    The arrays of all the items in a single contiguous buffer : img, mask and small-img of each item, and the
+    image of each item set once.
+    Arrays all restored from the same item cache bundle are already contiguous, they are kept as mapped.
+    """
+
+    def __init__(self, arrays: typing.List[np.ndarray]):
+        buffers = {id(mapped_buffer(array)) for array in arrays}
+        if len(arrays) > 0 and len(buffers) == 1 and mapped_buffer(arrays[0]) is not None:
+            self.buffer = None
+            self.mapped = mapped_buffer(arrays[0])
+            self.views = arrays
+            return
+
+        self.mapped = None
+        offsets = []
+        size = 0
+        for array in arrays:
+            size += -size % ALIGNMENT
+            offsets.append(size)
+            size += array.nbytes
+
+        self.buffer = np.empty(size, dtype=np.uint8)
+        self.views = []
+        for array, offset in zip(arrays, offsets):
+            view = self.buffer[offset:offset + array.nbytes].view(array.dtype).reshape(array.shape)
+            view[...] = array
+            view.flags.writeable = False
+            self.views.append(view)
+
+    @property
+    def nbytes(self) -> int:
+        if self.buffer is None:
+            return len(self.mapped)
+        return self.buffer.nbytes
+
+
+def displayed_texts(item: typing.Dict, language: str, use_llm: bool) -> typing.Dict[str, typing.Any]:
+    """
+    :return: The texts of the item the overlay displays in the language, resolved like
+    OverlayWindow.get_translation_of does.
+    """
+    texts = {}
+    for field in TEXT_FIELDS:
+        value = json_path(item, "translations", language, field)
+        if value is None and use_llm:
+            value = json_path(item, "translations", "llm", language, field)
+        if value is None:
+            value = item.get(field)
+        if value is not None:
+            texts[field] = value
+    return texts
+
+
+def compact_items(items: typing.List[typing.Dict], language: str, use_llm: bool) -> typing.Tuple[typing.List[ItemRecord], Atlas]:
+    """
+    Moves the arrays of the items to an atlas, and replaces the item dicts by records holding the texts of the
+    language only. Items of the same set share its image, and fully opaque masks of the same shape share one array.
+    The items list is emptied, so the dicts are freed as they are replaced.
+    """
+    opaque = {}
+    arrays = []
+    sets = set()
+    for item in items:
+        arrays.append(item["img"])
+        arrays.append(item["small-img"])
+        if np.all(item["mask"]):
+            opaque.setdefault(item["mask"].shape, None)
+        else:
+            arrays.append(item["mask"])
+        item_set = item.get("itemSet")
+        if item_set and item_set["slug"] not in sets:
+            sets.add(item_set["slug"])
+            arrays.append(item_set["img"])
+
+    atlas = Atlas(arrays)
+    views = iter(atlas.views)
+    for shape in opaque:
+        opaque[shape] = np.full(shape, 255, dtype=np.uint8)
+        opaque[shape].flags.writeable = False
+
+    # Each dict is replaced by its record as soon as it is built, so the memory it frees holds the next records
+    records = list(items)
+    items.clear()
+    shared_sets = {}
+    dropped_masks = 0
+    for i, item in enumerate(records):
+        record = ItemRecord()
+        record.slug = item["slug"]
+        record.name = item.get("name")
+        if "atk" in item:
+            record.atk = item["atk"]
+        record.translations = {language: displayed_texts(item, language, use_llm)}
+        record.img = next(views)
+        record.small_img = next(views)
+        record.small_shape = item["small-shape"]
+        if np.all(item["mask"]):
+            record.mask = opaque[item["mask"].shape]
+            dropped_masks += 1
+        else:
+            record.mask = next(views)
+        if "sift" in item:
+            record.sift = item["sift"]
+
+        item_set = item.get("itemSet")
+        if item_set:
+            if item_set["slug"] not in shared_sets:
+                shared_sets[item_set["slug"]] = {"slug": item_set["slug"], "img": next(views)}
+            item_set = shared_sets[item_set["slug"]]
+        record.item_set = item_set
+        records[i] = record
+
+    logging.info(f"{len(records)} items compacted in a {atlas.nbytes / 2 ** 20:.1f} MB atlas, "
+                 f"{len(shared_sets)} set images, {dropped_masks} opaque masks shared")
+    return records, atlas
@@ -0,0 +1,171 @@
+"""
+Detects the items of many screenshots without display, for example to audit the detection after a DB refresh.
+
+    python batch.py screenshots/ more.png [--output results.jsonl] [--workers 0] [--resolution 1920x1080]
+
+The item DB is loaded once into the item cache, with the SIFT descriptors when SIFT is used, and each worker process
+memory-maps the cached images, so they are shared between the processes instead of being copied. For the same reason
+the templates are not scaled to each screenshot resolution, prescale_templates is ignored and the screenshots are
+scaled to original_width instead. Screenshots are read and searched one at a time by each worker, and one JSON line
+is written per screenshot as soon as it is searched.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+import typing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import cv2 as cv
+
+from catalogue import create_item_cache, load_catalogue, load_config
+from detector import create_search_method, prepare_search_method, run_detection
+from prefilter import ColourPrefilter
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+
+# The detection state of a worker process, set once by init_worker
+_worker = {}
+
+
+def list_screenshots(paths: typing.List[str]) -> typing.Iterator[str]:
+    """
+    :return: The image files given, and the ones found in the directories given, lazily.
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for fname in sorted(files):
+                    if fname.lower().endswith(IMAGE_EXTENSIONS):
+                        yield os.path.join(root, fname)
+        else:
+            yield path
+
+
+def worker_config(config: typing.Dict) -> typing.Dict:
+    # Each process searches a single screenshot at once, the processes use the cores. The scaled templates would be
+    # copies made by each process, the screenshots are scaled instead.
+    return dict(config, matcher_threads=1, preprocess_workers=1, roi_prior_path="", item_prior_path="",
+                prescale_templates=False)
+
+
+def init_worker(config: typing.Dict):
+    logging.getLogger().setLevel(logging.WARNING)
+    config = worker_config(config)
+    cache = create_item_cache(config)
+    item_db, img_filter = load_catalogue(config, cache)
+    search_method = create_search_method(config)
+    prepare_search_method(search_method, item_db, cache)
+
+    _worker.update(
+        config=config,
+        item_db=item_db,
+        img_filter=img_filter,
+        search_method=search_method,
+        prefilter=ColourPrefilter(top_k=config["prefilter_top_k"]) if config["use_prefilter"] else None,
+    )
+
+
+def detect_file(path: str, resolution: typing.Optional[typing.Tuple[int, int]] = None) -> typing.Dict:
+    """
+    Searches the items of a screenshot, in a worker process.
+    :param resolution: The monitor resolution of the screenshots, their own size if None.
+    """
+    start = time.perf_counter()
+    screen = cv.imread(path)
+    if screen is None:
+        return {"file": path, "error": "Cannot read image"}
+
+    width, height = resolution or (screen.shape[1], screen.shape[0])
+    try:
+        found_items = run_detection(
+            screen,
+            width,
+            height,
+            _worker["item_db"],
+            None,
+            img_filter=_worker["img_filter"],
+            search_method=_worker["search_method"],
+            prefilter=_worker["prefilter"],
+            original_width=_worker["config"]["original_width"])
+    except Exception as e:
+        logging.exception(f"Detection of {path} failed !")
+        return {"file": path, "error": repr(e)}
+
+    return {
+        "file": path,
+        "resolution": f"{width}x{height}",
+        "items": [item["slug"] for item in found_items],
+        "ms": round((time.perf_counter() - start) * 1000, 1),
+    }
+
+
+def run_batch(config: typing.Dict,
+              paths: typing.Iterable[str],
+              output: typing.TextIO,
+              workers: int = 0,
+              resolution: typing.Optional[typing.Tuple[int, int]] = None) -> int:
+    """
+    Writes the detection results of the screenshots to output, one JSON line per screenshot, in completion order.
+    At most a few screenshots per worker are queued at once, so the memory does not depend on the number of files.
+    :param workers: The number of processes. 0 uses one process per core.
+    :return: The number of screenshots searched.
+    """
+    if config["prescale_templates"]:
+        logging.info("Templates are not prescaled in batch mode, the screenshots are scaled to original_width")
+    if config["cache_path"]:
+        # Preprocesses the missing images and describes them once, so the workers only map the cache
+        parent_config = worker_config(config)
+        cache = create_item_cache(parent_config)
+        item_db, _ = load_catalogue(parent_config, cache)
+        prepare_search_method(create_search_method(parent_config), item_db, cache)
+    else:
+        logging.warning("No cache_path configured, each worker preprocesses and keeps its own copy of the images")
+
+    workers = workers or os.cpu_count() or 1
+    done = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(config,)) as pool:
+        pending = set()
+        for path in paths:
+            pending.add(pool.submit(detect_file, path, resolution))
+            if len(pending) >= 4 * workers:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                done += write_results(finished, output)
+        finished, _ = wait(pending)
+        done += write_results(finished, output)
+    return done
+
+
+def write_results(futures, output: typing.TextIO) -> int:
+    for future in futures:
+        output.write(json.dumps(future.result()) + "\n")
+    output.flush()
+    return len(futures)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Neon Abyss item finder, without display")
+    parser.add_argument("paths", nargs="+", help="Screenshots, or directories of screenshots")
+    parser.add_argument("--config", default="neondb/conf.js")
+    parser.add_argument("--output", help="JSONL results file, standard output by default")
+    parser.add_argument("--workers", type=int, default=0, help="Worker processes, 0 uses one per core")
+    parser.add_argument("--resolution", help="Monitor resolution of the screenshots as 1920x1080, their size by default")
+    args = parser.parse_args()
+
+    resolution = None
+    if args.resolution:
+        w, h = args.resolution.split("x")
+        resolution = (int(w), int(h))
+
+    output = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    start = time.perf_counter()
+    try:
+        count = run_batch(load_config(args.config), list_screenshots(args.paths), output, args.workers, resolution)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    logging.info(f"{count} screenshots searched in {time.perf_counter() - start:.1f} s")
@@ -0,0 +1,497 @@
+"""
+Performance checks that run without display, on synthetic captures built from the item images.
+
+    python benchmark.py matchers [--captures 5] [--items 3] [--size 400x300]
+
+compares the per-detection time and the results of the search methods.
+
+    python benchmark.py prefilter [--captures 200] [--items 3] [--size 400x300]
+
+reports how often the items of a capture are kept in the colour pre-filter shortlist.
+
+    python benchmark.py pyramid [--captures 10] [--items 2] [--size 1280x720]
+
+checks the pyramid search method finds the same best item as the exhaustive template search, and exits with an
+error code if it does not.
+
+    python benchmark.py prior [--captures 30] [--items 2] [--size 400x300] [--recent 6]
+
+replays a session where most captures show a few recent items, and compares the template search with and without
+the item prior : right best item, items found, time, and template matches saved.
+
+    python benchmark.py memory
+
+reports the resident memory used by the loaded catalogue, as item dicts and as compact item records, with and without
+the item cache.
+
+    python benchmark.py corpus [--screenshots test_img/resolutions] [--methods template,frequency,pyramid,sift]
+
+runs the labelled screenshots through run_detection for each search method and filter, and reports the latency
+of each stage, the peak memory and the accuracy per resolution. The labels are read from labels.json in the
+screenshots directory, mapping each file name to the slugs of the items it shows. Screenshots of a region of the screen also give the
+resolution of the monitor, full screenshots are taken at their own size :
+
+    {"boss.png": ["angel-feather", "hunters-eye"], "shop.png": {"items": ["lucky-coin"], "resolution": "2560x1440"}}
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import statistics
+import time
+import tracemalloc
+import typing
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2 as cv
+import numpy as np
+from PIL import Image
+
+from catalogue import create_item_cache, load_catalogue, load_config
+from detector import create_search_method, run_detection
+from itemprior import ItemPrior
+from matcher import FrequencyMatcher, PyramidMatcher, TemplateMatcher
+from prefilter import ColourPrefilter
+from preprocess import make_transparent, trim_to_alpha
+from siftindex import SiftIndex
+from templates import TemplateSets
+import timings
+
+
+def synthetic_capture(slugs: typing.List[str], images_path: str, size: typing.Tuple[int, int], rng: np.random.Generator) -> Image:
+    """
+    Pastes the item images side by side on a noisy dark background, the way items lie on the game floor.
+    """
+    background = rng.integers(10, 60, (size[1], size[0], 3), dtype=np.uint8)
+    screen = Image.fromarray(background, "RGB")
+    x = 20
+    for slug in slugs:
+        sprite = Image.fromarray(trim_to_alpha(make_transparent(Image.open(os.path.join(images_path, f"{slug}.png")))), "RGBA")
+        y = int(rng.integers(0, max(1, size[1] - sprite.size[1])))
+        screen.paste(sprite, (x, y), sprite)
+        x += sprite.size[0] + 20
+    return screen
+
+
+def synthetic_screens(item_db: typing.List[typing.Dict],
+                      img_filter: typing.Callable,
+                      images_path: str,
+                      captures: int,
+                      items: int,
+                      size: typing.Tuple[int, int]) -> typing.List[typing.Tuple[typing.List[str], np.ndarray]]:
+    """
+    :return: (slugs, filtered screen) of random captures, always the same ones for the same parameters.
+    """
+    rng = np.random.default_rng(0)
+    screens = []
+    for _ in range(captures):
+        slugs = [item_db[i]["slug"] for i in rng.choice(len(item_db), items, replace=False)]
+        screens.append((slugs, img_filter(synthetic_capture(slugs, images_path, size, rng))))
+    return screens
+
+
+def benchmark_matchers(config: typing.Dict, captures: int, items: int, size: typing.Tuple[int, int]) -> typing.Dict:
+    item_db, img_filter = load_catalogue(config, create_item_cache(config))
+    screens = synthetic_screens(item_db, img_filter, config["images_path"], captures, items, size)
+
+    threads = config["matcher_threads"] or os.cpu_count() or 1
+    methods = {"template": TemplateMatcher(config["threshold"], threads=1)}
+    if threads > 1:
+        methods[f"template x{threads}"] = TemplateMatcher(config["threshold"], threads=threads)
+    methods["frequency"] = FrequencyMatcher(config["threshold"], threads=1, cache_mb=config["frequency_cache_mb"])
+    if threads > 1:
+        methods[f"frequency x{threads}"] = FrequencyMatcher(config["threshold"], threads=threads, cache_mb=config["frequency_cache_mb"])
+
+    report = {}
+    reference = None
+    for name, method in methods.items():
+        durations = []
+        results = []
+        for _, screen in screens:
+            start = time.perf_counter()
+            found = method(screen, item_db)
+            durations.append(time.perf_counter() - start)
+            results.append([item["slug"] for item in found])
+
+        if reference is None:
+            reference = results
+        report[name] = {
+            "median_ms": round(statistics.median(durations) * 1000, 1),
+            "max_ms": round(max(durations) * 1000, 1),
+            "median_s": statistics.median(durations),
+            "same_results": sum(1 for a, b in zip(results, reference) if a == b),
+            "found": sum(1 for (slugs, _), r in zip(screens, results) if set(slugs) <= set(r)),
+        }
+
+    base = report["template"]["median_s"]
+    for name, r in report.items():
+        r["speedup"] = round(base / r.pop("median_s"), 2)
+        print(f"{name:16} median {r['median_ms']:8.1f} ms  max {r['max_ms']:8.1f} ms  speedup x{r['speedup']:<5}"
+              f"  same results {r['same_results']}/{captures}  all items found {r['found']}/{captures}")
+    return report
+
+
+def benchmark_prefilter(config: typing.Dict, captures: int, items: int, size: typing.Tuple[int, int]) -> typing.Dict:
+    item_db, img_filter = load_catalogue(config, create_item_cache(config))
+    screens = synthetic_screens(item_db, img_filter, config["images_path"], captures, items, size)
+    prefilter = ColourPrefilter(top_k=config["prefilter_top_k"])
+
+    ranks = []
+    durations = []
+    for slugs, screen in screens:
+        start = time.perf_counter()
+        ranking = [item_db[i]["slug"] for i in prefilter.ranking(screen, item_db)]
+        durations.append(time.perf_counter() - start)
+        ranks.extend((ranking.index(slug), slug) for slug in slugs)
+
+    report = {
+        "median_ms": round(statistics.median(durations) * 1000, 2),
+        "recall": {},
+        "worst": sorted(ranks, reverse=True)[:5],
+    }
+    for k in sorted({5, 10, 20, 40, 80, config["prefilter_top_k"]}):
+        report["recall"][k] = round(sum(1 for rank, _ in ranks if rank < k) / len(ranks), 4)
+        print(f"top {k:3}: recall {report['recall'][k]:.2%}")
+    print(f"Median pre-filter time {report['median_ms']} ms, worst ranks {report['worst']}")
+    return report
+
+
+def check_pyramid(config: typing.Dict, captures: int, items: int, size: typing.Tuple[int, int]) -> typing.Dict:
+    item_db, img_filter = load_catalogue(config, create_item_cache(config))
+    screens = synthetic_screens(item_db, img_filter, config["images_path"], captures, items, size)
+    exhaustive = TemplateMatcher(config["threshold"], threads=config["matcher_threads"])
+    pyramid = PyramidMatcher(config["threshold"], threads=config["matcher_threads"],
+                             levels=config["pyramid_levels"], candidates=config["pyramid_candidates"])
+    pyramid.prepare(item_db)
+
+    report = {"captures": captures, "same_top_item": 0, "exhaustive_ms": [], "pyramid_ms": [], "differences": []}
+    for slugs, screen in screens:
+        start = time.perf_counter()
+        confidences = {item["slug"]: confidence for confidence, item in exhaustive.match(screen, item_db)}
+        expected = max(confidences, key=confidences.get)
+        report["exhaustive_ms"].append(round((time.perf_counter() - start) * 1000, 1))
+        start = time.perf_counter()
+        found = pyramid(screen, item_db)[0]["slug"]
+        report["pyramid_ms"].append(round((time.perf_counter() - start) * 1000, 1))
+
+        # Items matching perfectly differ by the rounding errors of matchTemplate, which depend on the searched area
+        if confidences[found] >= confidences[expected] - 1e-5:
+            report["same_top_item"] += 1
+        else:
+            report["differences"].append({"items": slugs, "exhaustive": expected, "pyramid": found})
+
+    report["speedup"] = round(statistics.median(report["exhaustive_ms"]) / statistics.median(report["pyramid_ms"]), 2)
+    print(f"Same top item {report['same_top_item']}/{captures}, median {statistics.median(report['exhaustive_ms']):.1f} ms"
+          f" -> {statistics.median(report['pyramid_ms']):.1f} ms (x{report['speedup']})")
+    for difference in report["differences"]:
+        print(f"    {difference}")
+    return report
+
+
+def benchmark_prior(config: typing.Dict, captures: int, items: int, size: typing.Tuple[int, int], recent: int) -> typing.Dict:
+    """
+    Replays a session where most captures show items of a small recent set, like the items of the current run,
+    with and without the item prior.
+    """
+    item_db, img_filter = load_catalogue(config, create_item_cache(config))
+    prefilter = ColourPrefilter(top_k=config["prefilter_top_k"]) if config["use_prefilter"] else None
+    rng = np.random.default_rng(0)
+    pool = [item_db[i]["slug"] for i in rng.choice(len(item_db), recent, replace=False)]
+    screens = []
+    for _ in range(captures):
+        # One capture out of five shows items never seen before
+        choices = pool if rng.random() < 0.8 else [item["slug"] for item in item_db]
+        slugs = [str(slug) for slug in rng.choice(choices, items, replace=False)]
+        screens.append((slugs, img_filter(synthetic_capture(slugs, config["images_path"], size, rng))))
+
+    exhaustive = TemplateMatcher(config["threshold"], threads=config["matcher_threads"])
+    adaptive = TemplateMatcher(config["threshold"], threads=config["matcher_threads"], prior=ItemPrior(),
+                               prior_margin=config["item_prior_margin"], prior_candidates=config["item_prior_candidates"])
+    # A capture shows several items, a short-circuit only returns the likely ones
+    report = {"captures": captures, "items": captures * items}
+    for name in ["exhaustive", "prior"]:
+        report[name] = {"top1": 0, "found_items": 0, "ms": []}
+    for slugs, screen in screens:
+        shortlist = prefilter.shortlist(screen, item_db) if prefilter is not None else item_db
+        for name, matcher in [("exhaustive", exhaustive), ("prior", adaptive)]:
+            start = time.perf_counter()
+            found = [item["slug"] for item in matcher(screen, shortlist)]
+            report[name]["ms"].append(round((time.perf_counter() - start) * 1000, 1))
+            report[name]["top1"] += int(found[0] in slugs)
+            report[name]["found_items"] += len([slug for slug in slugs if slug in found])
+
+    report["stats"] = dict(adaptive.stats)
+    for name in ["exhaustive", "prior"]:
+        print(f"{name:>10} : top item right {report[name]['top1']}/{captures}, {report[name]['found_items']}/{report['items']}"
+              f" items found, median {statistics.median(report[name]['ms']):.1f} ms")
+    print(f"{report['stats']['short_circuits']}/{report['stats']['searches']} short-circuits,"
+          f" {report['stats']['saved_matches']} template matches saved")
+    return report
+
+
+def current_rss_mb() -> typing.Optional[float]:
+    """
+    :return: The resident memory of the process, None where it is not available (only Linux is supported).
+    """
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return round(int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20, 1)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def objects_size(obj, seen: typing.Set[int] = None) -> int:
+    """
+    :return: The bytes of the python objects reachable from obj through dicts, lists, tuples and slots. Arrays and
+    their buffers are not counted.
+    """
+    seen = seen if seen is not None else set()
+    if id(obj) in seen or isinstance(obj, np.ndarray):
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(objects_size(key, seen) + objects_size(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(objects_size(value, seen) for value in obj)
+    elif hasattr(obj, "__slots__"):
+        size += sum(objects_size(getattr(obj, slot), seen) for slot in obj.__slots__ if hasattr(obj, slot))
+    return size
+
+
+def catalogue_memory(config: typing.Dict, compact: bool) -> typing.Dict:
+    """
+    Loads the catalogue and reads all its arrays, in a fresh process started by benchmark_memory.
+    """
+    import gc
+    before = current_rss_mb()
+    item_db, _ = load_catalogue(dict(config, compact_items=compact), create_item_cache(config))
+    # Cached arrays are memory mapped, reading them makes them resident like a search does
+    for item in item_db:
+        for key in ("img", "mask", "small-img"):
+            int(item[key].sum())
+        if item.get("itemSet"):
+            int(item["itemSet"]["img"].sum())
+    gc.collect()
+    try:
+        # Gives the freed heap back to the system, so only the memory still used is measured (glibc only)
+        import ctypes
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+    after = current_rss_mb()
+    return {
+        "items": len(item_db),
+        "rss_before_mb": before,
+        "rss_after_mb": after,
+        "catalogue_mb": round(after - before, 1) if before is not None and after is not None else None,
+        "objects_mb": round(objects_size(item_db) / 2 ** 20, 2),
+    }
+
+
+def benchmark_memory(config: typing.Dict) -> typing.Dict:
+    import multiprocessing
+    report = {}
+    for cache_path in ([config["cache_path"], ""] if config["cache_path"] else [""]):
+        for name, compact in (("dicts", False), ("compact", True)):
+            key = f"{name} {'cached' if cache_path else 'uncached'}"
+            # A fresh process for each, so the memory freed by the previous load is not reused
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+                report[key] = pool.submit(catalogue_memory, dict(config, cache_path=cache_path), compact).result()
+            print(f"{key:16} {report[key]['items']} items, resident memory {report[key]['rss_before_mb']} MB"
+                  f" -> {report[key]['rss_after_mb']} MB (catalogue {report[key]['catalogue_mb']} MB,"
+                  f" item objects without arrays {report[key]['objects_mb']} MB)")
+    return report
+
+
+def peak_rss_mb() -> typing.Optional[float]:
+    """
+    :return: The peak resident memory of the process, None where it is not available (Windows).
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere
+    return round(peak / (2 ** 20 if sys.platform == "darwin" else 2 ** 10), 1)
+
+
+def load_corpus(screenshots: str, labels_path: str = None) -> typing.List[typing.Tuple[str, np.ndarray, typing.List[str], typing.Tuple[int, int]]]:
+    """
+    :return: (file name, BGR screenshot, labelled slugs, monitor resolution) of the labelled screenshots.
+    """
+    with open(labels_path or os.path.join(screenshots, "labels.json"), "r", encoding="utf8") as labels_fp:
+        labels = json.load(labels_fp)
+
+    corpus = []
+    for fname in sorted(os.listdir(screenshots)):
+        if fname not in labels:
+            if not fname.endswith(".json"):
+                logging.warning(f"No label for {fname}, skipped")
+            continue
+        screen = cv.imread(os.path.join(screenshots, fname))
+        if screen is None:
+            logging.warning(f"Cannot read {fname}, skipped")
+            continue
+        label = labels[fname]
+        if isinstance(label, dict):
+            w, h = label["resolution"].split("x")
+            corpus.append((fname, screen, label["items"], (int(w), int(h))))
+        else:
+            corpus.append((fname, screen, label, (screen.shape[1], screen.shape[0])))
+    return corpus
+
+
+def benchmark_corpus(config: typing.Dict,
+                     screenshots: str,
+                     labels_path: str,
+                     methods: typing.List[str],
+                     filters: typing.List[str],
+                     repeat: int,
+                     top_k: int) -> typing.Dict:
+    corpus = load_corpus(screenshots, labels_path)
+    print(f"{len(corpus)} labelled screenshots")
+
+    report = {}
+    for filter_name in filters:
+        filter_config = dict(config, use_colors=filter_name == "colors")
+        item_db, img_filter = load_catalogue(filter_config, create_item_cache(filter_config))
+
+        for method_name in methods:
+            method_config = dict(filter_config, search_method=method_name, use_sift=False, roi_prior_path="", item_prior_path="")
+            search_method = create_search_method(method_config)
+            if isinstance(search_method, SiftIndex):
+                search_method.build(item_db)
+
+            templates = TemplateSets(config["original_width"]) if config["prescale_templates"] else None
+            prefilter = ColourPrefilter(top_k=config["prefilter_top_k"]) if config["use_prefilter"] else None
+
+            def detect(screen, resolution):
+                return run_detection(
+                    screen,
+                    resolution[0],
+                    resolution[1],
+                    item_db,
+                    None,
+                    img_filter=img_filter,
+                    search_method=search_method,
+                    templates=templates,
+                    prefilter=prefilter,
+                    original_width=config["original_width"])
+
+            # The first run of each screenshot warms the caches up and measures the memory, the next ones are timed
+            tracemalloc.start()
+            for _, screen, _, resolution in corpus:
+                detect(screen, resolution)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            timings.enable(window=len(corpus) * repeat)
+
+            resolutions = {}
+            for fname, screen, slugs, (width, height) in corpus:
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    found = [item["slug"] for item in detect(screen, (width, height))]
+                    timings.TIMINGS.add("total", time.perf_counter() - start)
+
+                resolution = resolutions.setdefault(f"{width}x{height}", {
+                    "screenshots": 0, "top1": 0, "topk": 0, "items": 0, "misses": []})
+                resolution["screenshots"] += 1
+                resolution["items"] += len(slugs)
+                if len(found) > 0 and found[0] in slugs:
+                    resolution["top1"] += 1
+                found_k = [slug for slug in slugs if slug in found[:top_k]]
+                resolution["topk"] += len(found_k)
+                if len(found_k) < len(slugs):
+                    resolution["misses"].append({"screenshot": fname, "expected": slugs, "found": found[:top_k]})
+
+            for name, resolution in resolutions.items():
+                resolution["top1_accuracy"] = round(resolution.pop("top1") / resolution["screenshots"], 4)
+                resolution[f"top{top_k}_recall"] = round(resolution.pop("topk") / max(resolution["items"], 1), 4)
+
+            combination = f"{method_name}/{filter_name}"
+            stages = timings.TIMINGS.report()
+            timings.TIMINGS.enabled = False
+            report[combination] = {
+                "stages": stages,
+                "peak_traced_mb": round(peak / 2 ** 20, 1),
+                "peak_rss_mb": peak_rss_mb(),
+                "resolutions": resolutions,
+            }
+            print(f"{combination}: total p50 {stages['total']['p50_ms']} ms p95 {stages['total']['p95_ms']} ms"
+                  f"  peak {report[combination]['peak_traced_mb']} MB")
+            for stage, p in stages.items():
+                print(f"    {stage:26} p50 {p['p50_ms']:9.2f} ms  p95 {p['p95_ms']:9.2f} ms  p99 {p['p99_ms']:9.2f} ms")
+            for name, resolution in sorted(resolutions.items()):
+                print(f"    {name:10} top-1 {resolution['top1_accuracy']:.2%}  top-{top_k} recall {resolution[f'top{top_k}_recall']:.2%}"
+                      f"  ({resolution['screenshots']} screenshots)")
+    return report
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    parser = argparse.ArgumentParser(description="Neon Abyss item finder benchmarks")
+    parser.add_argument("--config", default="neondb/conf.js")
+    parser.add_argument("--json", help="Also writes the report to this file")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    matchers_parser = commands.add_parser("matchers", help="Compares the search methods on synthetic captures")
+    matchers_parser.add_argument("--captures", type=int, default=5)
+    matchers_parser.add_argument("--items", type=int, default=3, help="Items per capture")
+    matchers_parser.add_argument("--size", default="400x300", help="Capture size, in original resolution pixels")
+
+    prefilter_parser = commands.add_parser("prefilter", help="Reports the recall of the colour pre-filter shortlist")
+    prefilter_parser.add_argument("--captures", type=int, default=200)
+    prefilter_parser.add_argument("--items", type=int, default=3, help="Items per capture")
+    prefilter_parser.add_argument("--size", default="400x300", help="Capture size, in original resolution pixels")
+
+    pyramid_parser = commands.add_parser("pyramid", help="Checks the pyramid search finds the same best item")
+    pyramid_parser.add_argument("--captures", type=int, default=10)
+    pyramid_parser.add_argument("--items", type=int, default=2, help="Items per capture")
+    pyramid_parser.add_argument("--size", default="1280x720", help="Capture size, in original resolution pixels")
+
+    prior_parser = commands.add_parser("prior", help="Compares the search with and without the item prior on a session")
+    prior_parser.add_argument("--captures", type=int, default=30)
+    prior_parser.add_argument("--items", type=int, default=2, help="Items per capture")
+    prior_parser.add_argument("--size", default="400x300", help="Capture size, in original resolution pixels")
+    prior_parser.add_argument("--recent", type=int, default=6, help="Items shown by most captures")
+
+    commands.add_parser("memory", help="Reports the memory used by the catalogue, with and without compact items")
+
+    corpus_parser = commands.add_parser("corpus", help="Measures the latency and accuracy on labelled screenshots")
+    corpus_parser.add_argument("--screenshots", default="test_img/resolutions")
+    corpus_parser.add_argument("--labels", help="Labels file, labels.json in the screenshots directory by default")
+    corpus_parser.add_argument("--methods", default="template,frequency,pyramid,sift")
+    corpus_parser.add_argument("--filters", default="colors,gray")
+    corpus_parser.add_argument("--repeat", type=int, default=3, help="Timed runs per screenshot")
+    corpus_parser.add_argument("--top-k", type=int, default=3)
+
+    args = parser.parse_args()
+    config = load_config(args.config)
+
+    if args.command == "matchers":
+        w, h = args.size.split("x")
+        result = benchmark_matchers(config, args.captures, args.items, (int(w), int(h)))
+    elif args.command == "prefilter":
+        w, h = args.size.split("x")
+        result = benchmark_prefilter(config, args.captures, args.items, (int(w), int(h)))
+    elif args.command == "pyramid":
+        w, h = args.size.split("x")
+        result = check_pyramid(config, args.captures, args.items, (int(w), int(h)))
+    elif args.command == "prior":
+        w, h = args.size.split("x")
+        result = benchmark_prior(config, args.captures, args.items, (int(w), int(h)), args.recent)
+    elif args.command == "memory":
+        result = benchmark_memory(config)
+    elif args.command == "corpus":
+        result = benchmark_corpus(config, args.screenshots, args.labels, args.methods.split(","),
+                                  args.filters.split(","), args.repeat, args.top_k)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+
+    if args.command == "pyramid" and len(result["differences"]) > 0:
+        sys.exit(1)
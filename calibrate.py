@@ -0,0 +1,115 @@
+"""
+Finds the fastest search settings that still find the right items on each monitor resolution, and saves them as
+resolution profiles that the overlay uses for the captures of these resolutions.
+
+    python calibrate.py test_img/resolutions [--labels labels.json] [--methods template,frequency,pyramid,sift]
+
+The screenshots are labelled like for `python benchmark.py corpus`. Every search method is run with the colour and
+gray filters, and with templates scaled to the monitor or captures scaled to original_width. For each resolution,
+the fastest combination ranking a labelled item first on all its screenshots is written to the profiles_path of
+the config. If none does, the most accurate one is written and a warning is logged.
+"""
+
+import argparse
+import logging
+import statistics
+import time
+import typing
+
+import numpy as np
+
+from benchmark import load_corpus
+from catalogue import create_item_cache, load_catalogue, load_config
+from detector import create_search_method, prepare_search_method, run_detection
+from loader import build_pipeline
+from profiles import resolution_key, write_profiles
+
+
+def run_trial(pipeline: typing.Dict,
+              captures: typing.List[typing.Tuple[str, np.ndarray, typing.List[str], typing.Tuple[int, int]]],
+              repeat: int) -> typing.Tuple[int, float]:
+    """
+    Runs each capture once to warm the caches up and check its best item, then repeat more times to time it.
+    :return: The number of captures whose best item is labelled, and the median detection time in ms.
+    """
+    correct = 0
+    for _, screen, slugs, (width, height) in captures:
+        found = run_detection(screen, width, height, window=None, **pipeline)
+        if len(found) > 0 and found[0]["slug"] in slugs:
+            correct += 1
+
+    durations = []
+    for _, screen, _, (width, height) in captures:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run_detection(screen, width, height, window=None, **pipeline)
+            durations.append(time.perf_counter() - start)
+    return correct, statistics.median(durations) * 1000
+
+
+def calibrate(config: typing.Dict,
+              corpus: typing.List[typing.Tuple[str, np.ndarray, typing.List[str], typing.Tuple[int, int]]],
+              methods: typing.List[str],
+              repeat: int) -> typing.Dict[str, typing.Dict]:
+    """
+    :return: The profile of each resolution of the corpus.
+    """
+    resolutions = {}
+    for capture in corpus:
+        resolutions.setdefault(resolution_key(*capture[3]), []).append(capture)
+
+    # Profiles are calibrated without the caches and priors that would hide the search time
+    base_config = dict(config, roi_prior_path="", item_prior_path="", detection_cache_size=0, profiles_path="", use_sift=False)
+    trials = {key: [] for key in resolutions}
+    for use_colors in [True, False]:
+        filter_config = dict(base_config, use_colors=use_colors)
+        cache = create_item_cache(filter_config)
+        item_db, img_filter = load_catalogue(filter_config, cache)
+
+        for method in methods:
+            method_config = dict(filter_config, search_method=method)
+            search_method = create_search_method(method_config)
+            prepare_search_method(search_method, item_db, cache)
+
+            for prescale_templates in [True, False]:
+                settings = {"search_method": method, "use_sift": False, "use_colors": use_colors, "prescale_templates": prescale_templates}
+                pipeline = build_pipeline(dict(method_config, prescale_templates=prescale_templates), item_db, img_filter, search_method)
+                for key, captures in resolutions.items():
+                    correct, latency = run_trial(pipeline, captures, repeat)
+                    logging.info(f"{key} {settings} : {correct}/{len(captures)} correct, {latency:.1f} ms")
+                    trials[key].append({"settings": settings, "correct": correct, "captures": len(captures), "latency_ms": round(latency, 1)})
+
+    profiles = {}
+    for key, results in trials.items():
+        # The most accurate first, then the fastest
+        best = min(results, key=lambda r: (-r["correct"], r["latency_ms"]))
+        if best["correct"] < best["captures"]:
+            logging.warning(f"No settings find the labelled items of all the {key} screenshots, "
+                            f"the best ones find {best['correct']}/{best['captures']} of them")
+        profiles[key] = best
+    return profiles
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Neon Abyss item finder, calibration of the search settings per resolution")
+    parser.add_argument("screenshots", help="Directory of labelled screenshots")
+    parser.add_argument("--labels", help="Labels file, labels.json in the screenshots directory by default")
+    parser.add_argument("--config", default="neondb/conf.js")
+    parser.add_argument("--methods", default="template,frequency,pyramid,sift", help="Search methods to try")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed detections of each screenshot")
+    parser.add_argument("--output", help="Profiles file, the profiles_path of the config by default")
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    output = args.output or config["profiles_path"]
+    if not output:
+        parser.error("No profiles file, set profiles_path in the config or use --output")
+
+    corpus = load_corpus(args.screenshots, args.labels)
+    logging.info(f"{len(corpus)} labelled screenshots")
+    profiles = calibrate(config, corpus, args.methods.split(","), args.repeat)
+    write_profiles(output, profiles)
+    for key, profile in sorted(profiles.items()):
+        print(f"{key:>10} : {profile['settings']} {profile['correct']}/{profile['captures']} correct, {profile['latency_ms']} ms")
+    logging.info(f"Profiles of {len(profiles)} resolutions written to {output}")
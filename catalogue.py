@@ -0,0 +1,162 @@
+import json
+import logging
+import os
+import typing
+
+import cv2 as cv
+import numpy as np
+from PIL import Image
+
+import itemdb
+from atlas import compact_items
+from config import load_config
+from itemcache import ItemCache
+from preprocess import create_img_filter, img_convert, preprocess_images
+
+
+def fetch_item_images(item: typing.Dict, images_path: str, set_images: typing.Dict[str, np.ndarray] = None) -> str:
+    """
+    Downloads the missing images of the item, and loads its item set image.
+    :param set_images: The set images already loaded by slug, so each one is decoded once.
+    :return: The path of the item image.
+    """
+    slug = item["slug"]
+    img_path = os.path.join(images_path, f"{slug}.png")
+
+    if not os.path.exists(img_path):
+        import requests
+        logging.info(f"Downloading {slug} image from {item['imgUrl']} to {img_path}")
+        r = requests.get(item["imgUrl"], allow_redirects=True)
+        with open(img_path, "wb") as f:
+            f.write(r.content)
+
+    if "itemSet" in item and item["itemSet"]:
+        set_slug = item['itemSet']['slug']
+        if set_images is not None and set_slug in set_images:
+            item['itemSet']['img'] = set_images[set_slug]
+            return img_path
+
+        set_img_path = os.path.join(images_path, f"itemset-{set_slug}.png")
+        if not os.path.exists(set_img_path):
+            import requests
+            logging.info(f"Downloading {set_slug} set from {item['itemSet']['url']}")
+            r = requests.get(item['itemSet']['url'], allow_redirects=True)
+            with open(set_img_path, "wb") as f:
+                f.write(r.content)
+        set_img = Image.open(set_img_path)
+        item['itemSet']['img'] = img_convert(set_img, color=cv.COLOR_BGR2RGB)
+        if set_images is not None:
+            set_images[set_slug] = item['itemSet']['img']
+
+    return img_path
+
+
+# Item keys holding arrays derived from the item image, pyramid-<levels> keys hold the reduced templates
+IMAGE_KEYS = ["img", "mask", "small-img", "small-shape", "sift"]
+
+
+def reuse_item_images(item: typing.Dict, previous: typing.Optional[typing.Dict]) -> bool:
+    """
+    Copies the arrays of the previously loaded version of the item, and the image of its set.
+    :return: True if the item has its arrays.
+    """
+    if previous is None or "img" not in previous:
+        return False
+    for key in previous.keys():
+        if key in IMAGE_KEYS or key.startswith("pyramid-"):
+            item[key] = previous[key]
+    if item.get("itemSet") and previous.get("itemSet") and item["itemSet"]["slug"] == previous["itemSet"]["slug"]:
+        item["itemSet"]["img"] = previous["itemSet"]["img"]
+    return True
+
+
+def load_item_db(dbpath: str,
+                 img_filter: typing.Callable,
+                 limit: typing.List = [],
+                 cache: ItemCache = None,
+                 images_path: str = "neondb/images",
+                 trim_to_alpha: bool = True,
+                 small_size_ratio: float = 0.7,
+                 workers: int = 0,
+                 language: str = "en",
+                 use_llm: bool = True,
+                 progress: typing.Callable[[int, int], typing.Any] = None,
+                 previous: typing.Dict[str, typing.Dict] = None):
+    """
+    Loads the items of a JSON or of a compact database, and their preprocessed images.
+    Compact databases only hold the texts of the language, JSON ones keep all the translations.
+    :param progress: Called with the number of images preprocessed and the total, items restored from the cache
+    are not counted.
+    :param previous: Items already loaded with the same preprocessing, by slug. Their arrays are reused.
+    """
+    if itemdb.is_item_db(dbpath):
+        items = itemdb.load_items(dbpath, language, use_llm, limit)
+    else:
+        with open(dbpath, "r", encoding='utf-8') as f:
+            items = json.load(f)
+
+        if len(limit) > 0:
+            items = [i for i in items if i["slug"] in limit]
+
+    previous = previous or {}
+    stale_items = [item for item in items
+                   if not reuse_item_images(item, previous.get(item["slug"])) and (cache is None or not cache.restore(item))]
+    set_images = {}
+    images = preprocess_images([fetch_item_images(item, images_path, set_images) for item in stale_items],
+                               img_filter,
+                               trim=trim_to_alpha,
+                               small_size_ratio=small_size_ratio,
+                               workers=workers,
+                               progress=progress)
+    for item, item_images in zip(stale_items, images):
+        item.update(item_images)
+        if cache is not None:
+            cache.store(item)
+
+    if cache is not None:
+        logging.info(f"{cache.hits} images restored from cache, {cache.misses} rebuilt")
+        cache.save()
+
+    logging.info(f"{len(items)} images loaded")
+    return items
+
+
+def create_item_cache(config: typing.Dict) -> typing.Optional[ItemCache]:
+    if not config["cache_path"]:
+        return None
+    return ItemCache(config["cache_path"], config["images_path"], {
+        "use_colors": config["use_colors"],
+        "trim_to_alpha": config["trim_to_alpha"],
+        "small_size_ratio": config["small_size_ratio"],
+    })
+
+
+def load_catalogue(config: typing.Dict, cache: ItemCache = None,
+                   progress: typing.Callable[[int, int], typing.Any] = None,
+                   previous: typing.Dict[str, typing.Dict] = None) -> typing.Tuple[typing.List[typing.Dict], typing.Callable]:
+    """
+    Loads the item DB as configured, as compact item records holding the texts of the language if compact_items
+    is set.
+    :param progress: Called with the number of images preprocessed and the total.
+    :param previous: Items already loaded with the same config, by slug. Their arrays are reused.
+    :return: The items, and the filter their images went through.
+    """
+    img_filter = create_img_filter(gray=not config["use_colors"])
+    item_db = load_item_db(
+        dbpath=config["item_db"],
+        img_filter=img_filter,
+        limit=config["limit_to_slugs"],
+        cache=cache,
+        images_path=config["images_path"],
+        trim_to_alpha=config["trim_to_alpha"],
+        small_size_ratio=config["small_size_ratio"],
+        workers=config["preprocess_workers"],
+        language=config["language"],
+        use_llm=config["use_llm_translation"],
+        progress=progress,
+        previous=previous
+    )
+    if config["compact_items"]:
+        # The records keep the atlas alive through their arrays
+        item_db, _ = compact_items(item_db, config["language"], config["use_llm_translation"])
+    return item_db, img_filter
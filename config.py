@@ -0,0 +1,20 @@
+import json
+import typing
+
+
+def load_config(path: str = "neondb/conf.js") -> typing.Dict:
+    with open(path, "r", encoding="utf8") as config_fp:
+        return json.load(config_fp)
+
+
+def json_path(obj, *args):
+    if obj is None:
+        return None
+
+    if len(args) <= 0:
+        return obj
+
+    if args[0] in obj:
+        return json_path(obj[args[0]], *args[1:])
+
+    return None
@@ -0,0 +1,48 @@
+import hashlib
+import logging
+import threading
+import typing
+from collections import OrderedDict
+
+import numpy as np
+
+
+class DetectionCache(object):
+    """
+    LRU cache of the detection results, keyed by a hash of the filtered screen, of the screen resolution and of
+    the matcher settings. Entries only reference the found items, and there are at most max_entries of them.
+    Reloading the item DB or the settings builds a new pipeline with a new cache, so no entry outlives them.
+    """
+
+    def __init__(self, max_entries: int = 32, settings: typing.Dict = None):
+        self.max_entries = max_entries
+        self.settings = settings or {}
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self._settings_key = repr(sorted(self.settings.items())).encode("utf-8")
+
+    def key(self, screen: np.ndarray, resolution_width: int) -> bytes:
+        h = hashlib.blake2b(self._settings_key, digest_size=16)
+        h.update(f"|{resolution_width}|{screen.shape}|{screen.dtype}|".encode("utf-8"))
+        h.update(np.ascontiguousarray(screen).data)
+        return h.digest()
+
+    def get(self, key: bytes) -> typing.Optional[typing.List[typing.Dict]]:
+        with self.lock:
+            found_items = self.entries.get(key)
+            if found_items is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.entries.move_to_end(key)
+        logging.info(f"Detection cache {'hit' if found_items is not None else 'miss'} ({self.hits} hits, {self.misses} misses)")
+        return found_items
+
+    def put(self, key: bytes, found_items: typing.List[typing.Dict]):
+        with self.lock:
+            self.entries[key] = found_items
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
@@ -0,0 +1,172 @@
+import copy
+import logging
+import typing
+
+import numpy as np
+
+from detectcache import DetectionCache
+from itemcache import ItemCache
+from itemprior import ItemPrior
+from matcher import FrequencyMatcher, PyramidMatcher, TemplateMatcher
+from prefilter import ColourPrefilter
+from preprocess import resize_nearest
+from profiles import ResolutionProfiles
+from roiprior import RoiPrior, RoiSearch
+from scheduler import DetectionJob
+from siftindex import SiftIndex
+from templates import TemplateSets
+import timings
+
+
+# Settings changing the detection results, the detection cache is keyed by them
+MATCHER_SETTINGS = ["item_db", "limit_to_slugs", "threshold", "trim_to_alpha", "original_width", "prescale_templates",
+                    "use_prefilter", "prefilter_top_k", "search_method", "early_exit_confidence", "use_sift", "use_colors",
+                    "roi_prior_path", "pyramid_levels", "pyramid_candidates", "item_prior_path", "item_prior_margin",
+                    "item_prior_candidates"]
+
+
+def search_priors(search_method: typing.Callable) -> typing.Tuple[typing.Optional[RoiPrior], typing.Optional[ItemPrior]]:
+    """
+    :return: The ROI prior and the item prior of the search method, None for the ones it does not use.
+    """
+    roi_prior = None
+    if isinstance(search_method, RoiSearch):
+        roi_prior = search_method.prior
+        search_method = search_method.matcher
+    return roi_prior, getattr(search_method, "prior", None)
+
+
+def create_search_method(config: typing.Dict, priors: typing.Tuple[RoiPrior, ItemPrior] = (None, None)) -> typing.Callable:
+    """
+    :param priors: The ROI prior and item prior of another search method, see search_priors. They are used instead
+    of new ones reading the same files, so the two search methods do not overwrite each other's files.
+    """
+    roi_prior, item_prior = priors
+    if item_prior is None or item_prior.path != config["item_prior_path"]:
+        item_prior = ItemPrior(config["item_prior_path"]) if config["item_prior_path"] else None
+    if roi_prior is None or roi_prior.path != config["roi_prior_path"] or roi_prior.min_hits != config["roi_prior_min_hits"]:
+        roi_prior = RoiPrior(config["roi_prior_path"], min_hits=config["roi_prior_min_hits"]) if config["roi_prior_path"] else None
+
+    if config["use_sift"] or config["search_method"] == "sift":
+        return SiftIndex()
+    if config["search_method"] == "frequency":
+        return FrequencyMatcher(
+            threshold=config["threshold"],
+            threads=config["matcher_threads"],
+            cache_mb=config["frequency_cache_mb"])
+    if config["search_method"] == "pyramid":
+        matcher = PyramidMatcher(
+            threshold=config["threshold"],
+            threads=config["matcher_threads"],
+            levels=config["pyramid_levels"],
+            candidates=config["pyramid_candidates"])
+    else:
+        matcher = TemplateMatcher(
+            threshold=config["threshold"],
+            threads=config["matcher_threads"],
+            early_exit_confidence=config["early_exit_confidence"],
+            prior=item_prior,
+            prior_margin=config["item_prior_margin"],
+            prior_candidates=config["item_prior_candidates"])
+    if roi_prior is not None:
+        return RoiSearch(matcher, roi_prior)
+    return matcher
+
+
+def prepare_search_method(search_method: typing.Callable, item_db: typing.List[typing.Dict], cache: ItemCache = None):
+    """
+    Builds what the search method needs from the items before its first search : the SIFT index, or the reduced
+    templates of the pyramid search.
+    """
+    if isinstance(search_method, SiftIndex):
+        search_method.build(item_db, cache)
+    matcher = search_method.matcher if isinstance(search_method, RoiSearch) else search_method
+    if isinstance(matcher, PyramidMatcher):
+        # Reduces the templates at load time rather than on the first search
+        matcher.prepare(item_db)
+
+
+def with_threshold(search_method: typing.Callable, threshold: float) -> typing.Callable:
+    """
+    :return: A copy of the search method using the threshold. The copy shares the caches and thread pool of the
+    search method, which keeps its threshold for the searches already running.
+    """
+    if isinstance(search_method, RoiSearch):
+        search_method = copy.copy(search_method)
+        search_method.matcher = with_threshold(search_method.matcher, threshold)
+    elif hasattr(search_method, "threshold"):
+        search_method = copy.copy(search_method)
+        search_method.threshold = threshold
+    return search_method
+
+
+def run_detection(screen: np.ndarray,
+                  resolution_width: int,
+                  resolution_height: int,
+                  item_db: typing.List[typing.Dict],
+                  window,
+                  img_filter: typing.Callable,
+                  search_method: typing.Callable,
+                  templates: TemplateSets = None,
+                  prefilter: ColourPrefilter = None,
+                  detection_cache: DetectionCache = None,
+                  job: DetectionJob = None,
+                  original_width: int = 1920,
+                  profiles: ResolutionProfiles = None):
+    """
+    Finds the items of a capture, and shows them in the window.
+    :param window: The overlay window, or None to only return the found items.
+    :param original_width: The screen width the item images were captured at.
+    :param profiles: The settings calibrated per resolution, they replace the other arguments for the captures of
+    a calibrated resolution.
+    :return: The found items, None if the job was cancelled.
+    """
+    cancel = job.cancelled if job is not None else None
+    if profiles is not None:
+        profile = profiles.pipeline(resolution_width, resolution_height)
+        if profile is not None:
+            item_db, img_filter, search_method = profile["item_db"], profile["img_filter"], profile["search_method"]
+            templates, prefilter, detection_cache = profile["templates"], profile["prefilter"], profile["detection_cache"]
+    if window is not None:
+        window.set_message("Searching...")
+
+    if templates is not None:
+        # Templates are scaled to the screen once per resolution, the capture is matched as is
+        with timings.span("templates"):
+            items = templates.get(item_db, resolution_width)
+        scaled_screen = screen
+        logging.info(f"Screen size : {resolution_width}x{resolution_height}. Image size: {screen.shape}")
+    else:
+        items = item_db
+        ratio = original_width / resolution_width
+        img_h, img_w = screen.shape[0], screen.shape[1]
+        # Same pixels as the PIL NEAREST resampling the captures were resized with
+        with timings.span("resize"):
+            scaled_screen = resize_nearest(screen, (int(img_w * ratio), int(img_h * ratio)))
+        logging.info(f"Screen size : {resolution_width}x{resolution_height}. Image ratio: {screen.shape} -> {scaled_screen.shape}")
+    logging.info(f"Item size: {items[0]['img'].shape}")
+
+    with timings.span("filter"):
+        screen = img_filter(scaled_screen)
+    found_items = None
+    if detection_cache is not None:
+        with timings.span("detection cache"):
+            cache_key = detection_cache.key(screen, resolution_width)
+            found_items = detection_cache.get(cache_key)
+
+    if found_items is None:
+        if prefilter is not None:
+            with timings.span("prefilter"):
+                items = prefilter.shortlist(screen, items)
+            logging.info(f"Shortlisted items are {[i['slug'] for i in items]}")
+        with timings.span(f"search {getattr(search_method, '__name__', type(search_method).__name__)}"):
+            found_items = search_method(screen, items, cancel=cancel)
+        if cancel is not None and cancel.is_set():
+            logging.info(f"Detection job {job.id} cancelled, its results are dropped")
+            return None
+        if detection_cache is not None:
+            detection_cache.put(cache_key, found_items)
+    logging.info(f"Matched items are {[i['name'] for i in found_items]}")
+    if window is not None:
+        window.set_items(found_items, job.id if job is not None else None)
+    return found_items
@@ -1,12 +1,15 @@
 # WARNING
 # Requires torch (install via https://pytorch.org/ if you have cuda/cudnn, or via pip install torch to use CPU).
 
+import hashlib
 import json
 import logging
 import os
 import re
 import typing
 
+from config import json_path
+from itemdb import write_item_db
 from translate import Translator
 
 translation_model = "facebook/nllb-200-distilled-600M"
@@ -15,22 +18,14 @@ item_db_src = ["neondb/items.db"]
 abyss_db_src = "neondb/sources/abyssexplorer/items.json"
 
 output_path = "neondb/items.db"
+compact_output_path = "neondb/items.sqlite"
+translation_memory_path = "neondb/sources/translation_memory.jsonl"
+# Results of the items processed by an interrupted run, and the source hashes of the last complete run
+journal_path = "neondb/sources/generate_item_db.journal"
+state_path = "neondb/sources/generate_item_db.state.json"
 languages = ["de", "es", "fr", "it", "ja", "ru", "zh"]
 
 
-def json_path(obj, *args):
-    if obj is None:
-        return None
-
-    if len(args) <= 0:
-        return obj
-
-    if args[0] in obj:
-        return json_path(obj[args[0]], *args[1:])
-
-    return None
-
-
 def json_insert(dst: typing.Dict, dst_path: typing.List, value):
     for p in dst_path[:-1]:
         if not p in dst:
@@ -39,14 +34,18 @@ def json_insert(dst: typing.Dict, dst_path: typing.List, value):
     dst[dst_path[-1]] = value
 
 
-def translate_field(item: typing.Dict, abyss_item: typing.Dict, field_path: typing.List, abyss_field: str = None, language: str = "fr", translator: Translator = None):
+def translate_field(item: typing.Dict, abyss_item: typing.Dict, field_path: typing.List, abyss_field: str = None, language: str = "fr") -> typing.Optional[str]:
+    """
+    Uses the abyssexplorer translation of the field if there is one.
+    :return: The text to translate with the model, None if the field is already translated or empty.
+    """
     if not abyss_field:
         abyss_field = field_path[-1]
 
     already_translated = json_path(item, "translations", language, *field_path) is not None \
                          or json_path(item, "translations", "llm", language, *field_path) is not None
     if already_translated:
-        return
+        return None
 
     abyss_value = json_path(abyss_item, abyss_field, language)
     item_value = json_path(item, *field_path)
@@ -55,20 +54,101 @@ def translate_field(item: typing.Dict, abyss_item: typing.Dict, field_path: typi
         logging.info(f"Using abyssexplorer translation of item {item['name']} {abyss_field} for {language} language")
         json_insert(item, ["translations", language] + field_path, abyss_value)
 
-    elif item_value and translator:
-        logging.info(f"Generating translation of item {item['name']} {abyss_field} for {language} language")
-        json_insert(item, ["translations", "llm", language] + field_path, translator.translate(item_value))
+    elif item_value:
+        return item_value
 
+    return None
 
-def translate_item(item: typing.Dict, abyss_db: typing.List[typing.Dict], language: str, translator: Translator):
-    slug = item["slug"]
 
-    abyss_slug = re.sub("[^a-z0-9]", "-", slug.lower()).strip('-')
-    abyss_items = [i for i in abyss_db if i["slug"].lower() == abyss_slug]
-    abyss_item = abyss_items[0] if len(abyss_items) > 0 else None
+def abyss_slug_of(slug: str) -> str:
+    return re.sub("[^a-z0-9]", "-", slug.lower()).strip('-')
 
+
+def index_abyss_db(abyss_db: typing.List[typing.Dict]) -> typing.Dict[str, typing.Dict]:
+    """
+    :return: The abyssexplorer items by lower case slug, the first one of each slug.
+    """
+    index = {}
+    for abyss_item in abyss_db:
+        index.setdefault(abyss_item["slug"].lower(), abyss_item)
+    return index
+
+
+def source_hash(item: typing.Dict, abyss_item: typing.Optional[typing.Dict]) -> str:
+    """
+    :return: A hash of the texts the translations of the item are made from.
+    """
+    sources = {field: item.get(field) for field in ["name", "desc", "passive"]}
+    return hashlib.sha1(json.dumps([sources, abyss_item], sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def translate_item(item: typing.Dict, abyss_item: typing.Optional[typing.Dict], language: str) -> typing.List[typing.Tuple[typing.List, str]]:
+    """
+    :return: The (field path, text) of the fields to translate with the model.
+    """
+    pending = []
     for field_path in [["name"], ["desc"], ["passive"]]:
-        translate_field(item, abyss_item, field_path, None, language, translator)
+        text = translate_field(item, abyss_item, field_path, None, language)
+        if text is not None:
+            pending.append((field_path, text))
+    return pending
+
+
+def clear_translations(item: typing.Dict):
+    """
+    Removes the model translations of the item, and the abyssexplorer ones of the fields translate_item fills.
+    """
+    if json_path(item, "translations", "llm"):
+        item["translations"]["llm"] = {}
+    for language in languages:
+        translation = json_path(item, "translations", language)
+        if translation is None:
+            continue
+        for field in ["name", "desc", "passive"]:
+            translation.pop(field, None)
+        if len(translation) < 1:
+            del item["translations"][language]
+
+
+def read_journal(path: str) -> typing.Dict[typing.Tuple[str, str], typing.Dict]:
+    """
+    :return: The journal entries by (slug, language), the last one wins.
+    """
+    entries = {}
+    if not os.path.exists(path):
+        return entries
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # Last line of an interrupted run
+                continue
+            entries[(entry["slug"], entry["lang"])] = entry
+    return entries
+
+
+def journal_entry(item: typing.Dict, language: str, hash: str) -> typing.Dict:
+    return {
+        "slug": item["slug"],
+        "lang": language,
+        "hash": hash,
+        "translation": json_path(item, "translations", language),
+        "llm": json_path(item, "translations", "llm", language),
+    }
+
+
+def apply_journal_entry(item: typing.Dict, entry: typing.Dict):
+    if entry["translation"] is not None:
+        json_insert(item, ["translations", entry["lang"]], entry["translation"])
+    if entry["llm"] is not None:
+        json_insert(item, ["translations", "llm", entry["lang"]], entry["llm"])
+
+
+def write_json(obj, path: str):
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        json.dump(obj, f, indent=2)
+    os.replace(f"{path}.tmp", path)
 
 
 if __name__ == '__main__':
@@ -81,22 +161,64 @@ if __name__ == '__main__':
             item_db.extend(json.load(f))
 
     with open(abyss_db_src, "r", encoding='utf-8') as f:
-        abyss_db = json.load(f)
+        abyss_index = index_abyss_db(json.load(f))
+
+    state = {}
+    if os.path.exists(state_path):
+        with open(state_path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    journal = read_journal(journal_path)
 
+    # Only the items whose texts changed since the last complete run are translated again
+    changed = []
+    hashes = {}
     for item in item_db:
         if json_path(item, "translations", "llm", "en"):
             del item["translations"]["llm"]["en"]
 
-    for lang in languages:
-        translator = Translator(
-            model_name=translation_model,
-            src_lang=Translator.get_nllb_lang("en"),
-            dst_lang=Translator.get_nllb_lang(lang)
-        )
-
-        for item in item_db:
-            translate_item(item, abyss_db, lang, translator)
-
-            with open(f"{output_path}.tmp", "w") as f:
-                json.dump(item_db, f, indent=2)
-            os.replace(f"{output_path}.tmp", output_path)
\ No newline at end of file
+        abyss_item = abyss_index.get(abyss_slug_of(item["slug"]))
+        hashes[item["slug"]] = source_hash(item, abyss_item)
+        if state.get(item["slug"]) == hashes[item["slug"]]:
+            continue
+        if item["slug"] in state:
+            # Translations of the previous texts, the abyssexplorer ones are taken again from abyss_item
+            clear_translations(item)
+        changed.append((item, abyss_item))
+    logging.info(f"{len(changed)} items changed since the last run, {len(journal)} results journaled")
+
+    translator = None
+    with open(journal_path, "a", encoding="utf-8") as journal_fp:
+        for lang in languages:
+            pending = []
+            processed = []
+            for item, abyss_item in changed:
+                entry = journal.get((item["slug"], lang))
+                if entry is not None and entry["hash"] == hashes[item["slug"]]:
+                    apply_journal_entry(item, entry)
+                    continue
+                pending.extend((item, field_path, text) for field_path, text in translate_item(item, abyss_item, lang))
+                processed.append(item)
+
+            if len(pending) > 0:
+                if translator is None:
+                    # One model for all the languages, the target language is chosen at each call
+                    translator = Translator(
+                        model_name=translation_model,
+                        src_lang=Translator.get_nllb_lang("en"),
+                        memory_path=translation_memory_path
+                    )
+                logging.info(f"Generating {len(pending)} translations for {lang} language")
+                translations = translator.translate_batch([text for _, _, text in pending], Translator.get_nllb_lang(lang))
+                for (item, field_path, _), translation in zip(pending, translations):
+                    json_insert(item, ["translations", "llm", lang] + field_path, translation)
+
+            for item in processed:
+                journal_fp.write(json.dumps(journal_entry(item, lang, hashes[item["slug"]]), ensure_ascii=False) + "\n")
+            journal_fp.flush()
+
+    # The complete DB is written once, then the journal is not needed anymore
+    write_json(item_db, output_path)
+    write_item_db(item_db, compact_output_path)
+    write_json(hashes, state_path)
+    os.remove(journal_path)
+    logging.info(f"{len(item_db)} items written")
@@ -0,0 +1,177 @@
+import hashlib
+import json
+import logging
+import os
+import typing
+
+import numpy as np
+
+# Increase when the preprocessing changes, to invalidate all the cached arrays.
+CACHE_VERSION = 1
+
+ALIGNMENT = 64
+
+
+class ItemCache(object):
+    """
+    On-disk cache of the preprocessed item arrays (img, mask, small-img, sift descriptors and itemSet img).
+
+    All arrays are stored back to back in a single raw bundle described by a json index, so a warm start only
+    memory-maps the bundle. Each set of configuration knobs changing the preprocessing result has its own folder in
+    cache_path, so loading the items with other knobs does not replace the cached ones. Each entry is keyed by the
+    hash of its source PNG and by these knobs. Stale entries are rebuilt by the caller, stored again, and written on
+    save().
+    """
+
+    def __init__(self, cache_path: str, images_path: str, params: typing.Dict):
+        self._params_key = json.dumps(params, sort_keys=True)
+        self.cache_path = os.path.join(cache_path, ItemCache.folder_of(self._params_key))
+        self.images_path = images_path
+        self.params = params
+        self.entries = {}
+        self.generation = 0
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    @staticmethod
+    def folder_of(params_key: str) -> str:
+        return f"params-{hashlib.sha1(params_key.encode('utf-8')).hexdigest()[:12]}"
+
+    @property
+    def index_path(self):
+        return os.path.join(self.cache_path, "index.json")
+
+    def _load(self):
+        if not os.path.exists(self.index_path):
+            return
+
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+
+            if index.get("version") != CACHE_VERSION:
+                logging.info(f"Item cache version {index.get('version')} is outdated, it will be rebuilt")
+                return
+
+            self.generation = index["generation"]
+            if len(index["entries"]) < 1:
+                return
+
+            bundle = np.memmap(os.path.join(self.cache_path, index["bundle"]), dtype=np.uint8, mode="r")
+            for name, entry in index["entries"].items():
+                arrays = {}
+                for field, (offset, shape, dtype) in entry["arrays"].items():
+                    size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+                    arrays[field] = np.asarray(bundle[offset:offset + size]).view(dtype).reshape(shape)
+                self.entries[name] = {"key": entry["key"], "meta": entry["meta"], "arrays": arrays}
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logging.warning(f"Ignoring unreadable item cache {self.cache_path} : {e}")
+            self.entries = {}
+
+        logging.info(f"{len(self.entries)} entries found in item cache {self.cache_path}")
+
+    def _file_key(self, path: str, with_params: bool = True) -> typing.Optional[str]:
+        if not os.path.exists(path):
+            return None
+
+        h = hashlib.sha1(f"{CACHE_VERSION}|".encode("utf-8"))
+        if with_params:
+            h.update(f"{self._params_key}|".encode("utf-8"))
+        with open(path, "rb") as f:
+            h.update(f.read())
+        return h.hexdigest()
+
+    def _item_key(self, item: typing.Dict) -> typing.Optional[str]:
+        return self._file_key(os.path.join(self.images_path, f"{item['slug']}.png"))
+
+    def _set_key(self, item: typing.Dict) -> typing.Optional[str]:
+        set_slug = item["itemSet"]["slug"]
+        return self._file_key(os.path.join(self.images_path, f"itemset-{set_slug}.png"), with_params=False)
+
+    def _get(self, name: str, key: typing.Optional[str]) -> typing.Optional[typing.Dict]:
+        entry = self.entries.get(name)
+        if key is None or entry is None or entry["key"] != key:
+            return None
+        return entry
+
+    def _put(self, name: str, key: typing.Optional[str], arrays: typing.Dict[str, np.ndarray], meta: typing.Dict = None):
+        entry = self._get(name, key)
+        if key is None or (entry is not None and entry["arrays"].keys() >= arrays.keys()):
+            return
+        self.entries[name] = {"key": key, "meta": meta or {}, "arrays": arrays}
+        self.dirty = True
+
+    def restore(self, item: typing.Dict) -> bool:
+        """
+        Fills the item with its cached arrays.
+        :return: False if the item is not cached or if its cached entry is stale.
+        """
+        entry = self._get(f"item:{item['slug']}", self._item_key(item))
+        set_entry = None
+        if entry is not None and "itemSet" in item and item["itemSet"]:
+            set_entry = self._get(f"itemset:{item['itemSet']['slug']}", self._set_key(item))
+            if set_entry is None:
+                entry = None
+
+        if entry is None:
+            self.misses += 1
+            return False
+
+        if set_entry is not None:
+            item["itemSet"]["img"] = set_entry["arrays"]["img"]
+        item.update(entry["arrays"])
+        item["small-shape"] = tuple(entry["meta"]["small-shape"])
+        self.hits += 1
+        return True
+
+    def store(self, item: typing.Dict):
+        arrays = {"img": item["img"], "mask": item["mask"], "small-img": item["small-img"]}
+        if "sift" in item:
+            arrays["sift"] = item["sift"]
+        self._put(f"item:{item['slug']}", self._item_key(item), arrays, {"small-shape": list(item["small-shape"])})
+
+        if "itemSet" in item and item["itemSet"]:
+            self._put(f"itemset:{item['itemSet']['slug']}", self._set_key(item), {"img": item["itemSet"]["img"]})
+
+    def save(self):
+        """
+        Writes a new bundle and its index if some entries have been added since the cache was loaded.
+        The previous bundle may still be mapped, so the new one is written under another name.
+        """
+        if not self.dirty:
+            return
+
+        os.makedirs(self.cache_path, exist_ok=True)
+        self.generation += 1
+        bundle_name = f"bundle-{self.generation}.bin"
+        index = {"version": CACHE_VERSION, "generation": self.generation, "params": self.params, "bundle": bundle_name, "entries": {}}
+
+        with open(os.path.join(self.cache_path, bundle_name), "wb") as f:
+            offset = 0
+            for name, entry in self.entries.items():
+                arrays = {}
+                for field, array in entry["arrays"].items():
+                    array = np.ascontiguousarray(array)
+                    padding = -offset % ALIGNMENT
+                    f.write(b"\0" * padding)
+                    offset += padding
+                    arrays[field] = [offset, list(array.shape), array.dtype.str]
+                    f.write(array.tobytes())
+                    offset += array.nbytes
+                index["entries"][name] = {"key": entry["key"], "meta": entry["meta"], "arrays": arrays}
+
+        with open(f"{self.index_path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        os.replace(f"{self.index_path}.tmp", self.index_path)
+        self.dirty = False
+        logging.info(f"Item cache saved to {self.cache_path} ({len(self.entries)} entries)")
+
+        for fname in os.listdir(self.cache_path):
+            if fname.startswith("bundle-") and fname != bundle_name:
+                try:
+                    os.remove(os.path.join(self.cache_path, fname))
+                except OSError:
+                    # Still mapped by a running instance, it will be removed by the next save.
+                    pass
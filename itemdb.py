@@ -0,0 +1,157 @@
+"""
+Compact item database, stored in SQLite and indexed by slug.
+
+The texts of each item are flattened for each language : a text is the translation of the language, else its
+LLM translation when they are used, else the english text. Only the texts differing from the english ones are
+stored, and loading the database only reads the texts of the displayed language.
+
+    python itemdb.py neondb/items.db neondb/items.sqlite
+
+converts the JSON database written by generate_item_db.py.
+"""
+import json
+import logging
+import os
+import sqlite3
+import sys
+import typing
+
+from config import json_path
+
+# Increase when the layout changes
+ITEM_DB_VERSION = 1
+
+# The fields displayed by the overlay, translated in the texts table
+TEXT_FIELDS = ["name", "desc", "passive", "active"]
+
+SQLITE_HEADER = b"SQLite format 3\x00"
+
+
+def is_item_db(path: str) -> bool:
+    """
+    :return: True if the file is a compact item database, False if it is a JSON one.
+    """
+    with open(path, "rb") as f:
+        return f.read(len(SQLITE_HEADER)) == SQLITE_HEADER
+
+
+def language_texts(item: typing.Dict, language: str) -> typing.Tuple[typing.Dict, typing.Dict]:
+    """
+    :return: The translated texts of the item differing from the english ones, and the LLM translated texts of the
+    fields without translation, so they resolve the way OverlayWindow.get_translation_of does.
+    """
+    texts = {}
+    llm_texts = {}
+    for field in TEXT_FIELDS:
+        value = json_path(item, "translations", language, field)
+        if value is not None:
+            if value != item.get(field):
+                texts[field] = value
+            continue
+        value = json_path(item, "translations", "llm", language, field)
+        if value is not None and value != item.get(field):
+            llm_texts[field] = value
+    return texts, llm_texts
+
+
+def compact_json(value) -> typing.Optional[str]:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")) if value else None
+
+
+def languages_of(items: typing.List[typing.Dict]) -> typing.List[str]:
+    languages = {"en"}
+    for item in items:
+        translations = item.get("translations") or {}
+        languages.update(lang for lang in translations if lang != "llm")
+        languages.update(translations.get("llm") or {})
+    return sorted(languages)
+
+
+def write_item_db(items: typing.List[typing.Dict], path: str):
+    """
+    Writes the items to a new compact database, replacing the existing one once it is complete.
+    """
+    tmp_path = f"{path}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    languages = languages_of(items)
+    db = sqlite3.connect(tmp_path)
+    try:
+        db.executescript("""
+            CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+            CREATE TABLE items (slug TEXT PRIMARY KEY, position INTEGER NOT NULL, data TEXT NOT NULL);
+            CREATE TABLE texts (language TEXT NOT NULL, slug TEXT NOT NULL, data TEXT, llm_data TEXT,
+                                PRIMARY KEY (language, slug)) WITHOUT ROWID;
+        """)
+        db.executemany("INSERT INTO meta VALUES (?, ?)", [
+            ("version", str(ITEM_DB_VERSION)),
+            ("languages", json.dumps(languages)),
+        ])
+
+        for position, item in enumerate(items):
+            data = {k: v for k, v in item.items() if k != "translations"}
+            db.execute("INSERT INTO items VALUES (?, ?, ?)", (item["slug"], position, compact_json(data)))
+            for language in languages:
+                texts, llm_texts = language_texts(item, language)
+                if texts or llm_texts:
+                    db.execute("INSERT INTO texts VALUES (?, ?, ?, ?)",
+                               (language, item["slug"], compact_json(texts), compact_json(llm_texts)))
+        db.commit()
+        db.execute("VACUUM")
+    finally:
+        db.close()
+
+    os.replace(tmp_path, path)
+    logging.info(f"{len(items)} items written to {path} in {len(languages)} languages")
+
+
+def load_items(path: str, language: str = "en", use_llm: bool = True, limit: typing.List[str] = []) -> typing.List[typing.Dict]:
+    """
+    Reads the items in the database order, with the texts of a single language.
+    The texts are put in item["translations"][language], where the overlay looks for them first.
+    """
+    db = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        version = db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if version is None or int(version[0]) != ITEM_DB_VERSION:
+            raise ValueError(f"Item database {path} has version {version and version[0]}, expected {ITEM_DB_VERSION}")
+
+        query = f"""
+            SELECT items.data, texts.data, {'texts.llm_data' if use_llm else 'NULL'} FROM items
+            LEFT JOIN texts ON texts.language = ? AND texts.slug = items.slug
+        """
+        params = [language]
+        if len(limit) > 0:
+            query += f" WHERE items.slug IN ({','.join('?' * len(limit))})"
+            params.extend(limit)
+        query += " ORDER BY items.position"
+
+        items = []
+        for data, texts, llm_texts in db.execute(query, params):
+            item = json.loads(data)
+            resolved = {field: item[field] for field in TEXT_FIELDS if field in item}
+            if texts is not None:
+                resolved.update(json.loads(texts))
+            if llm_texts is not None:
+                resolved.update(json.loads(llm_texts))
+            item["translations"] = {language: resolved}
+            items.append(item)
+    finally:
+        db.close()
+
+    logging.info(f"{len(items)} items read from {path} in {language}")
+    return items
+
+
+def convert(src: str, path: str):
+    with open(src, "r", encoding="utf-8") as f:
+        write_item_db(json.load(f), path)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) != 3:
+        print("Usage : python itemdb.py <items.db JSON> <items.sqlite>")
+        sys.exit(1)
+    convert(sys.argv[1], sys.argv[2])
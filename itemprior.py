@@ -0,0 +1,62 @@
+import json
+import logging
+import os
+import threading
+import typing
+
+
+class ItemPrior(object):
+    """
+    How often and how recently each item was found, saved to a json file. Each recorded search decays the scores of
+    all the items by decay, and adds 1 to the scores of the items found, so recent finds weigh the most.
+    """
+
+    def __init__(self, path: str = None, decay: float = 0.9, min_score: float = 0.01):
+        """
+        :param min_score: Items whose score decays below it are forgotten.
+        """
+        self.path = path
+        self.decay = decay
+        self.min_score = min_score
+        self.lock = threading.Lock()
+        self.scores = {}
+        self._load()
+
+    def _load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.scores = {slug: float(score) for slug, score in json.load(f)["scores"].items()}
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            logging.warning(f"Ignoring unreadable item prior {self.path} : {e}")
+            self.scores = {}
+
+    def save(self):
+        if self.path is None:
+            return
+        with self.lock:
+            data = {"scores": dict(self.scores)}
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(f"{self.path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(f"{self.path}.tmp", self.path)
+
+    def record(self, slugs: typing.List[str]):
+        """
+        Records the items found by a search.
+        """
+        with self.lock:
+            scores = {slug: score * self.decay for slug, score in self.scores.items() if score * self.decay >= self.min_score}
+            for slug in set(slugs):
+                scores[slug] = scores.get(slug, 0) + 1
+            self.scores = scores
+
+    def likeliest(self, items: typing.List[typing.Dict], count: int) -> typing.List[int]:
+        """
+        :return: The indexes of the count items with the best scores, best first. Items never found are not part of them.
+        """
+        scores = self.scores
+        scored = [(scores[item["slug"]], i) for i, item in enumerate(items) if item["slug"] in scores]
+        scored.sort(key=lambda s: (-s[0], s[1]))
+        return [i for _, i in scored[:count]]
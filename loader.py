@@ -0,0 +1,122 @@
+import logging
+import threading
+import time
+import typing
+
+
+class CatalogueLoader(object):
+    """
+    Loads the item DB and builds the detection pipeline on a background thread, so the overlay shows up and the
+    inputs are listened to while the images are loaded. The heavy modules are only imported by this thread.
+    """
+
+    def __init__(self, config: typing.Dict, window=None, start_time: float = None):
+        """
+        :param window: The overlay window showing the loading progress, None to only log it.
+        :param start_time: The time.perf_counter() of the application start, the time to ready is logged from it.
+        """
+        self.config = config
+        self.window = window
+        self.start_time = start_time if start_time is not None else time.perf_counter()
+        self.ready = threading.Event()
+        self.pipeline = None
+        self.cache = None
+        self.shown_step = -1
+
+    def start(self):
+        thread = threading.Thread(target=self.run, name="catalogue")
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def wait(self, cancel: threading.Event = None) -> typing.Optional[typing.Dict]:
+        """
+        Waits until the catalogue is loaded, or until cancel is set.
+        :return: The run_detection arguments of the pipeline, None if cancelled or if the loading failed.
+        """
+        while not self.ready.wait(0.1):
+            if cancel is not None and cancel.is_set():
+                return None
+        return self.pipeline
+
+    def _message(self, message: str):
+        if self.window is not None:
+            self.window.set_message(message)
+
+    def _progress(self, done: int, total: int):
+        # The overlay is refreshed every 10 %, not for each image
+        step = done * 10 // total
+        if step != self.shown_step:
+            self.shown_step = step
+            self._message(f"Loading items... {done}/{total}")
+
+    def run(self):
+        try:
+            self.pipeline = self._load()
+            logging.info(f"Ready after {time.perf_counter() - self.start_time:.2f} s")
+            self._message("Waiting...")
+        except Exception:
+            logging.exception("Loading the catalogue failed !")
+            self._message("Loading the items failed !")
+        finally:
+            self.ready.set()
+
+        # The calibrated resolutions use the default pipeline until theirs is built
+        if self.pipeline is not None and self.pipeline["profiles"] is not None:
+            self.pipeline["profiles"].build()
+
+    def _load(self) -> typing.Dict:
+        from catalogue import create_item_cache, load_catalogue
+        from detector import create_search_method, prepare_search_method
+        from siftindex import SiftIndex
+
+        config = self.config
+        self._message("Loading items...")
+        logging.info("Reading BD...")
+        self.cache = create_item_cache(config)
+        item_db, img_filter = load_catalogue(config, self.cache, progress=self._progress)
+
+        search_method = create_search_method(config)
+        if isinstance(search_method, SiftIndex):
+            self._message("Indexing items...")
+        prepare_search_method(search_method, item_db, self.cache)
+        return build_pipeline(config, item_db, img_filter, search_method, cache=self.cache)
+
+
+def build_pipeline(config: typing.Dict, item_db: typing.List[typing.Dict], img_filter: typing.Callable,
+                   search_method: typing.Callable, templates=None, prefilter=None, cache=None) -> typing.Dict:
+    """
+    :param templates: The template sets to keep, new ones are made if None and prescale_templates is set.
+    :param prefilter: The prefilter to keep, a new one is made if None and use_prefilter is set.
+    :param cache: The item cache the items were loaded with, used by the resolution profiles.
+    :return: The run_detection arguments, with a new detection cache keyed by the config, and the resolution
+    profiles of profiles_path. Their pipelines are not built yet, see ResolutionProfiles.build.
+    """
+    from detectcache import DetectionCache
+    from detector import MATCHER_SETTINGS
+    from prefilter import ColourPrefilter
+    from profiles import ResolutionProfiles, read_profiles
+    from templates import TemplateSets
+
+    if templates is None and config["prescale_templates"]:
+        templates = TemplateSets(config["original_width"])
+    if prefilter is None and config["use_prefilter"]:
+        prefilter = ColourPrefilter(top_k=config["prefilter_top_k"])
+    detection_cache = None
+    if config["detection_cache_size"] > 0:
+        detection_cache = DetectionCache(config["detection_cache_size"], {k: config[k] for k in MATCHER_SETTINGS})
+
+    pipeline = {
+        "item_db": item_db,
+        "img_filter": img_filter,
+        "search_method": search_method,
+        "templates": templates if config["prescale_templates"] else None,
+        "prefilter": prefilter if config["use_prefilter"] else None,
+        "detection_cache": detection_cache,
+        "original_width": config["original_width"],
+        "profiles": None,
+    }
+    profiles = read_profiles(config["profiles_path"])
+    if len(profiles) > 0:
+        pipeline["profiles"] = ResolutionProfiles(config, profiles, pipeline, cache)
+    return pipeline
@@ -0,0 +1,345 @@
+import logging
+import os
+import threading
+import typing
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
+
+import cv2 as cv
+import numpy as np
+
+from itemprior import ItemPrior
+
+
+def find_object_via_template_matcher(obj_img, screen_img, method=cv.TM_SQDIFF, mask=None):
+    h, w = obj_img.shape[0], obj_img.shape[1]
+    sh, sw = screen_img.shape[0], screen_img.shape[1]
+
+    try:
+        res = cv.matchTemplate(screen_img, obj_img, method, mask=mask)
+        min_val, max_val, min_loc, max_loc = cv.minMaxLoc(res)
+
+        # If the method is TM_SQDIFF or TM_SQDIFF_NORMED, take minimum
+        if method in [cv.TM_SQDIFF, cv.TM_SQDIFF_NORMED]:
+            top_left = min_loc
+            confidence = min_val
+            if method == cv.TM_SQDIFF_NORMED:
+                confidence = 1.0 - confidence
+        else:
+            top_left = max_loc
+            confidence = max_val
+
+        return top_left, (top_left[0] + w, top_left[1] + h), confidence
+    except Exception as e:
+        logging.exception(f"Error matching [{w},{h}] template against [{sw}, {sh}] {e}", stack_info=False)
+        return (0, 0), (0, 0), 0
+
+
+def rank_matches(matches: typing.List[typing.Tuple[float, typing.Dict]], threshold: float) -> typing.List[typing.Dict]:
+    """
+    :return: The items matching above the threshold from best to worst, or the best item if none does.
+    """
+    matches.sort(key=itemgetter(0), reverse=True)
+    results = [m[1] for m in matches if m[0] > threshold]
+    if len(results) < 1 and len(matches) > 0:
+        results = [matches[0][1]]
+
+    return results
+
+
+class TemplateMatcher(object):
+    """
+    Searches items via template matching, with the item list sharded across a pool of threads.
+    OpenCV releases the GIL while matching, so the shards run in parallel.
+
+    When early_exit_confidence is set, the search stops as soon as an item reaches it, and only the items
+    evaluated so far are ranked. Otherwise the results are the same as a serial search.
+    With an item prior, the prior_candidates items found the most often and the most recently are matched first.
+    If one of them matches prior_margin above the threshold, the other items are skipped, otherwise they are
+    all matched too. The stats count the detections, the ones skipping items, and the template matches skipped.
+    They and the prior are updated once per detection by record_search, however many searches it made.
+    Setting the cancel event also stops the search, with partial results.
+    """
+
+    def __init__(self, threshold: float = 0.9, threads: int = 0, early_exit_confidence: float = 0, method=cv.TM_SQDIFF_NORMED,
+                 prior: ItemPrior = None, prior_margin: float = 0.05, prior_candidates: int = 8):
+        self.threshold = threshold
+        self.threads = threads or os.cpu_count() or 1
+        self.early_exit_confidence = early_exit_confidence
+        self.method = method
+        self.pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="matcher") if self.threads > 1 else None
+        self.prior = prior
+        self.prior_margin = prior_margin
+        self.prior_candidates = prior_candidates
+        self.stats_lock = threading.Lock()
+        self.stats = {"searches": 0, "short_circuits": 0, "saved_matches": 0}
+
+    def match(self, screen, items: typing.List, cancel: threading.Event = None) -> typing.List[typing.Tuple[float, typing.Dict]]:
+        """
+        :return: The (confidence, item) of every evaluated item, in the items order.
+        """
+        return [(confidence, item) for confidence, item, _ in self.match_locations(screen, items, cancel)]
+
+    def _match_indexes(self, screen, items: typing.List, indexes: typing.List[int], cancel: threading.Event = None) -> typing.Dict[int, typing.Tuple[float, typing.Tuple[int, int]]]:
+        """
+        :return: The (confidence, top left corner of the best match) of the evaluated items, by index.
+        """
+        found = {}
+        stop = threading.Event()
+
+        def match_shard(shard):
+            for i in shard:
+                if stop.is_set() or (cancel is not None and cancel.is_set()):
+                    return
+                top_left, _, confidence = find_object_via_template_matcher(items[i]["img"], screen, self.method, mask=items[i]["mask"])
+                found[i] = (confidence, top_left)
+                if self.early_exit_confidence and confidence >= self.early_exit_confidence:
+                    logging.info(f"{items[i]['slug']} matched with confidence {confidence}, stopping search")
+                    stop.set()
+
+        if self.pool is None:
+            match_shard(indexes)
+        else:
+            # Interleaved shards, so each thread gets a similar mix of template sizes
+            shards = [indexes[t::self.threads] for t in range(self.threads)]
+            list(self.pool.map(match_shard, shards))
+        return found
+
+    def _match_likeliest_first(self, screen, items: typing.List, cancel: threading.Event, search: typing.Dict) -> typing.Dict[int, typing.Tuple[float, typing.Tuple[int, int]]]:
+        likeliest = self.prior.likeliest(items, self.prior_candidates)
+        found = self._match_indexes(screen, items, likeliest, cancel)
+        best = max((confidence for confidence, _ in found.values()), default=0)
+        skipped = len(items) - len(likeliest)
+        if len(found) > 0 and best >= self.threshold + self.prior_margin:
+            search["short_circuits"] = search.get("short_circuits", 0) + 1
+            search["saved_matches"] = search.get("saved_matches", 0) + skipped
+            logging.info(f"Likely item matched with confidence {best:.3f}, {skipped} items skipped")
+        else:
+            others = set(likeliest)
+            found.update(self._match_indexes(screen, items, [i for i in range(len(items)) if i not in others], cancel))
+        return found
+
+    def match_locations(self, screen, items: typing.List, cancel: threading.Event = None, search: typing.Dict = None) -> typing.List[typing.Tuple[float, typing.Dict, typing.Tuple[int, int]]]:
+        """
+        :param search: Shared by the searches of one detection, it counts the items the prior let them skip. It is
+        given to record_search once the detection is done.
+        :return: The (confidence, item, top left corner of the best match) of every evaluated item, in the items order.
+        """
+        if self.prior is not None:
+            found = self._match_likeliest_first(screen, items, cancel, search if search is not None else {})
+        else:
+            found = self._match_indexes(screen, items, list(range(len(items))), cancel)
+        return [(found[i][0], item, found[i][1]) for i, item in enumerate(items) if i in found]
+
+    def record_search(self, search: typing.Dict, matches: typing.List[typing.Tuple], cancel: threading.Event = None):
+        """
+        Updates the stats and records the items found in the prior, once per detection.
+        :param search: The dict given to the match_locations calls of the detection.
+        :param matches: The (confidence, item, ...) found by the detection.
+        """
+        if self.prior is None or (cancel is not None and cancel.is_set()):
+            return
+        with self.stats_lock:
+            self.stats["searches"] += 1
+            self.stats["short_circuits"] += int(search.get("short_circuits", 0) > 0)
+            self.stats["saved_matches"] += search.get("saved_matches", 0)
+        matched = [match[1]["slug"] for match in matches if match[0] > self.threshold]
+        if len(matched) > 0:
+            self.prior.record(matched)
+            self.prior.save()
+        logging.info(f"Prior stats : {self.stats}")
+
+    def __call__(self, screen, items: typing.List, cancel: threading.Event = None):
+        search = {}
+        matches = self.match_locations(screen, items, cancel, search)
+        self.record_search(search, matches, cancel)
+        return rank_matches([(confidence, item) for confidence, item, _ in matches], self.threshold)
+
+
+class PyramidMatcher(TemplateMatcher):
+    """
+    Coarse to fine template matching : all the items are matched on the screen reduced levels times by half,
+    with templates and masks reduced once per item, then only the candidates best coarse items are matched at
+    full scale, around their coarse location.
+    Items too small or too thin to be reduced are matched at full scale on the whole screen.
+    """
+
+    def __init__(self, threshold: float = 0.9, threads: int = 0, levels: int = 2, candidates: int = 5, method=cv.TM_SQDIFF_NORMED):
+        super().__init__(threshold=threshold, threads=threads, method=method)
+        self.levels = levels
+        self.candidates = candidates
+        self.scale = 2 ** levels
+        self.min_size = 8
+
+    def reduced(self, item: typing.Dict) -> typing.Optional[typing.Dict]:
+        """
+        :return: The reduced img and mask of the item, computed once and kept in the item. None if it is too small.
+        """
+        key = f"pyramid-{self.levels}"
+        # Scaled copies of the item share this entry, it is only valid for the image it was reduced from
+        if key not in item or item[key][0] is not item["img"]:
+            h, w = item["img"].shape[0] // self.scale, item["img"].shape[1] // self.scale
+            small = None
+            if min(w, h) >= self.min_size:
+                # Only the reduced pixels made of opaque pixels alone, the others blend the background in
+                _, mask = cv.threshold(cv.resize(item["mask"], (w, h), interpolation=cv.INTER_AREA), 254, 255, cv.THRESH_BINARY)
+                if cv.countNonZero(mask) >= self.min_size * 2:
+                    small = {
+                        "slug": item["slug"],
+                        "img": cv.resize(item["img"], (w, h), interpolation=cv.INTER_AREA),
+                        "mask": mask,
+                    }
+            item[key] = (item["img"], small)
+        return item[key][1]
+
+    def prepare(self, items: typing.List[typing.Dict]):
+        for item in items:
+            self.reduced(item)
+
+    def match_locations(self, screen, items: typing.List, cancel: threading.Event = None, search: typing.Dict = None) -> typing.List[typing.Tuple[float, typing.Dict, typing.Tuple[int, int]]]:
+        sh, sw = screen.shape[0], screen.shape[1]
+        small_screen = cv.resize(screen, (max(1, sw // self.scale), max(1, sh // self.scale)), interpolation=cv.INTER_AREA)
+
+        coarse_items = []
+        fine_items = []
+        for item in items:
+            small = self.reduced(item)
+            if small is None or small["img"].shape[0] > small_screen.shape[0] or small["img"].shape[1] > small_screen.shape[1]:
+                fine_items.append(item)
+            else:
+                coarse_items.append((small, item))
+
+        coarse = super().match_locations(small_screen, [small for small, _ in coarse_items], cancel, search)
+        by_slug = {small["slug"]: item for small, item in coarse_items}
+        coarse.sort(key=itemgetter(0), reverse=True)
+        logging.info(f"Coarse candidates : {[(m[1]['slug'], round(m[0], 3)) for m in coarse[:self.candidates]]}")
+
+        matches = super().match_locations(screen, fine_items, cancel, search) if len(fine_items) > 0 else []
+        margin = 2 * self.scale
+        for _, small, (x, y) in coarse[:self.candidates]:
+            if cancel is not None and cancel.is_set():
+                break
+            item = by_slug[small["slug"]]
+            h, w = item["img"].shape[0], item["img"].shape[1]
+            x0, y0 = max(0, x * self.scale - margin), max(0, y * self.scale - margin)
+            x1, y1 = min(sw, x * self.scale + w + margin), min(sh, y * self.scale + h + margin)
+            (fx, fy), _, confidence = find_object_via_template_matcher(item["img"], screen[y0:y1, x0:x1], self.method, mask=item["mask"])
+            matches.append((confidence, item, (fx + x0, fy + y0)))
+
+        # In the items order like the exhaustive search, so items matching equally are ranked the same way
+        order = {id(item): i for i, item in enumerate(items)}
+        matches.sort(key=lambda m: order[id(m[1])])
+        return matches
+
+
+class FrequencyMatcher(object):
+    """
+    Searches items via a masked TM_SQDIFF_NORMED computed in the frequency domain.
+
+    With a binary mask M, the normed squared difference between a template T and the screen I is
+    (sum(T²M) - 2 corr(I, T.M) + corr(I², M)) / sqrt(sum(T²M) . corr(I², M)), summed over the channels.
+    The screen is transformed once per detection, so each item only costs the transform of its padded and
+    masked template and two inverse transforms. Item batches run on a thread pool, as cv.dft releases the GIL.
+    Template spectra are kept for the next captures of the same size, up to cache_mb megabytes.
+    """
+
+    def __init__(self, threshold: float = 0.9, threads: int = 0, batch_size: int = 32, cache_mb: int = 256):
+        self.threshold = threshold
+        self.threads = threads or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.cache_mb = cache_mb
+        self.pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="matcher") if self.threads > 1 else None
+        self.lock = threading.Lock()
+        self._shape = None
+        self._spectra = {}
+        self._spectra_size = 0
+
+    @staticmethod
+    def _channels(img: np.ndarray) -> typing.List[np.ndarray]:
+        img = img.astype(np.float32)
+        if img.ndim < 3:
+            return [img]
+        return [np.ascontiguousarray(img[:, :, c]) for c in range(img.shape[2])]
+
+    @staticmethod
+    def _pad(img: np.ndarray, shape: typing.Tuple[int, int]) -> np.ndarray:
+        return cv.copyMakeBorder(img, 0, shape[0] - img.shape[0], 0, shape[1] - img.shape[1], cv.BORDER_CONSTANT, value=0)
+
+    @staticmethod
+    def _prepare_template(item: typing.Dict) -> typing.Tuple[float, typing.List[np.ndarray], np.ndarray]:
+        m = (item["mask"] > 0).astype(np.float32)
+        masked = [channel * m for channel in FrequencyMatcher._channels(item["img"])]
+        energy = float(sum(np.sum(np.square(channel, dtype=np.float64)) for channel in masked))
+        return energy, masked, m
+
+    def _reset_spectra(self, shape: typing.Tuple[int, int]):
+        with self.lock:
+            if shape != self._shape:
+                self._shape = shape
+                self._spectra = {}
+                self._spectra_size = 0
+
+    def _template_spectra(self, item: typing.Dict, shape: typing.Tuple[int, int]) -> typing.Tuple[float, typing.List[np.ndarray]]:
+        # Spectra are kept per template array, so they are shared by all the item lists holding it
+        cached = self._spectra.get(id(item["img"]))
+        if cached is not None and cached[0] is item["img"]:
+            return cached[1], cached[2]
+
+        energy, masked, m = FrequencyMatcher._prepare_template(item)
+        spectra = [cv.dft(FrequencyMatcher._pad(channel, shape)) for channel in masked + [m]]
+        size = sum(s.nbytes for s in spectra)
+        with self.lock:
+            if shape == self._shape and self._spectra_size + size <= self.cache_mb * 1024 * 1024:
+                self._spectra[id(item["img"])] = (item["img"], energy, spectra)
+                self._spectra_size += size
+        return energy, spectra
+
+    def match(self, screen, items: typing.List, cancel: threading.Event = None) -> typing.List[typing.Tuple[float, typing.Dict]]:
+        """
+        :return: The (confidence, item) of every item, in the items order. Setting cancel stops the search.
+        """
+        sh, sw = screen.shape[0], screen.shape[1]
+        shape = (cv.getOptimalDFTSize(sh), cv.getOptimalDFTSize(sw))
+        self._reset_spectra(shape)
+
+        channels = FrequencyMatcher._channels(screen)
+        screen_spectra = [cv.dft(FrequencyMatcher._pad(channel, shape)) for channel in channels]
+        square_spectrum = cv.dft(FrequencyMatcher._pad(sum(cv.multiply(c, c) for c in channels), shape))
+        confidences = [0] * len(items)
+
+        def match_batch(indexes):
+            for i in indexes:
+                if cancel is not None and cancel.is_set():
+                    return
+                th, tw = items[i]["img"].shape[0], items[i]["img"].shape[1]
+                if th > sh or tw > sw:
+                    logging.error(f"Error matching [{tw},{th}] template against [{sw}, {sh}]")
+                    continue
+
+                energy, spectra = self._template_spectra(items[i], shape)
+                correlation = None
+                for screen_spectrum, spectrum in zip(screen_spectra, spectra[:-1]):
+                    product = cv.mulSpectrums(screen_spectrum, spectrum, 0, conjB=True)
+                    correlation = product if correlation is None else correlation + product
+                flags = cv.DFT_INVERSE | cv.DFT_REAL_OUTPUT | cv.DFT_SCALE
+                cross = cv.dft(correlation, flags=flags)[:sh - th + 1, :sw - tw + 1]
+                screen_energy = cv.dft(cv.mulSpectrums(square_spectrum, spectra[-1], 0, conjB=True), flags=flags)[:sh - th + 1, :sw - tw + 1]
+
+                denominator = np.sqrt(energy * np.maximum(screen_energy, 0))
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    result = np.where(denominator > 0, (energy - 2 * cross + screen_energy) / denominator, np.inf)
+                # Perfect matches are left with float32 rounding noise, that matchTemplate reports as exact
+                difference = float(result.min())
+                confidences[i] = 1.0 - (difference if difference > 1e-6 else 0.0)
+
+        batches = [range(b, min(b + self.batch_size, len(items))) for b in range(0, len(items), self.batch_size)]
+        if self.pool is None:
+            for batch in batches:
+                match_batch(batch)
+        else:
+            list(self.pool.map(match_batch, batches))
+
+        return list(zip(confidences, items))
+
+    def __call__(self, screen, items: typing.List, cancel: threading.Event = None):
+        return rank_matches(self.match(screen, items, cancel), self.threshold)
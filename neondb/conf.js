@@ -9,19 +9,48 @@
     "clear": "<Enter>",
     "column_size": 150,
     "topmost": true,
+    "watch_fps": 0,
+    "watch_region": null,
+    "watch_threshold": 4.0,
 
-    "item_db": "neondb/items.db",
+    "item_db": "neondb/items.sqlite",
     "images_path": "neondb/images",
+    "cache_path": "neondb/cache",
     "limit_to_slugs": [],
+    "preprocess_workers": 0,
+    "compact_items": false,
+    "reload_interval": 1.0,
 
     "threshold": 0.9,
+    "use_prefilter": true,
+    "prefilter_top_k": 40,
+    "search_method": "template",
+    "matcher_threads": 0,
+    "early_exit_confidence": 0,
+    "pyramid_levels": 2,
+    "pyramid_candidates": 5,
+    "frequency_cache_mb": 256,
+    "detection_cache_size": 32,
+    "roi_prior_path": "",
+    "roi_prior_min_hits": 3,
+    "item_prior_path": "",
+    "item_prior_margin": 0.05,
+    "item_prior_candidates": 8,
+    "profiles_path": "neondb/profiles.json",
     "trim_to_alpha": true,
     "original_width": 1920,
     "original_height": 1080,
     "original_pixel_size": 3,
+    "prescale_templates": true,
     "small_size_ratio": 0.7,
     "use_sift": false,
     "use_colors": true,
     "use_llm_translation": true,
-    "language": "fr"
+    "language": "fr",
+
+    "timings": false,
+    "timings_window": 256,
+    "timings_overlay": false,
+    "timings_dump": "<Button-3>",
+    "timings_path": "timings.json"
 }
\ No newline at end of file
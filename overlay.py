@@ -1,12 +1,15 @@
 import logging
 import queue
 
-import cv2 as cv
-from PIL import Image, ImageTk
-
 import tkinter as tk
 from tkinter import Tk
 
+import timings
+from config import json_path
+
+# Virtual event generated when an action is posted to the event queue
+QUEUE_EVENT = "<<NeonQueue>>"
+
 
 class OverlayWindow(Tk):
 
@@ -15,8 +18,8 @@ class OverlayWindow(Tk):
         self.lift()
         self.iconbitmap("neondb/neon.ico")
         self.title("neonabyss_tooltip")
-        self.check_interval = 100
         self.evtQueue = queue.Queue()
+        self.bind(QUEUE_EVENT, self.__process_queue)
         self.column_size = 150
         self.bgcolor = "black"
         self.fgcolor = "white"
@@ -36,52 +39,135 @@ class OverlayWindow(Tk):
                               )
         self.language = language
         self.use_llm = use_llm
+        self.displayed_job = 0
+        self.message_lbl = None
+        self.columns = []
+        self.displays = {}
+        self.show_timings = False
+        self.timings_lbl = None
+
+    def __label(self, font=None):
+        return tk.Label(self.frame,
+                        font=font or self.small_font,
+                        background=self.bgcolor,
+                        foreground=self.fgcolor,
+                        wraplength=self.column_size,
+                        justify="center")
+
+    def __column(self, i):
+        # Labels are created once per column, and updated in place by the next renders
+        while len(self.columns) <= i:
+            self.columns.append({
+                "name": self.__label(self.large_font),
+                "img": tk.Label(self.frame),
+                "desc": self.__label(),
+                "set": self.__label(),
+                "variant": self.__label(),
+            })
+        return self.columns[i]
 
     def __clear(self):
-        for child in self.frame.winfo_children():
-            child.destroy()
+        if self.message_lbl is not None:
+            self.message_lbl.grid_remove()
+        if self.timings_lbl is not None:
+            self.timings_lbl.grid_remove()
+        for column in self.columns:
+            for lbl in column.values():
+                lbl.grid_remove()
 
     def __message(self, text):
         self.__clear()
-        lbl = tk.Label(self.frame,
-                          text=text,
-                          font=self.small_font,
-                          background=self.bgcolor,
-                          foreground=self.fgcolor,
-                          wraplength=self.column_size,
-                          justify="center")
-        lbl.grid(row=1, column=1)
+        if self.message_lbl is None:
+            self.message_lbl = self.__label()
+        self.message_lbl.configure(text=text)
+        self.message_lbl.grid(row=1, column=1)
         self.pack()
         self.__position()
         self.lift()
 
-    @staticmethod
-    def json_path(obj, *args):
-        if obj is None:
-            return None
-
-        if len(args) <= 0:
-            return obj
-
-        if args[0] in obj:
-            return OverlayWindow.json_path(obj[args[0]], *args[1:])
-
-        return None
-
     def get_translation_of(self, item, *field_path):
-        value = OverlayWindow.json_path(item, "translations", self.language, *field_path)
+        value = json_path(item, "translations", self.language, *field_path)
         if value is not None:
             return value
 
         if self.use_llm:
-            value = OverlayWindow.json_path(item, "translations", "llm", self.language, *field_path)
+            value = json_path(item, "translations", "llm", self.language, *field_path)
 
         if value is not None:
             return value
 
-        return OverlayWindow.json_path(item, *field_path)
-
-    def __items(self, items):
+        return json_path(item, *field_path)
+
+    def __display_of(self, item):
+        """
+        :return: The texts and images displayed for the item, resolved once per item and language.
+        """
+        key = (item["slug"], self.language, self.use_llm)
+        display = self.displays.get(key)
+        if display is not None:
+            return display
+
+        # Imported on the first render, so the window shows up before OpenCV and PIL are loaded
+        import cv2 as cv
+        from PIL import Image, ImageTk
+
+        display = {
+            "name": self.get_translation_of(item, "name"),
+            "desc": self.get_translation_of(item, "desc"),
+            "img": ImageTk.PhotoImage(image=Image.fromarray(cv.cvtColor(item["small-img"], cv.COLOR_RGB2BGR))),
+            "set": None,
+            "set_slug": None,
+            "variant": None,
+        }
+
+        if "itemSet" in item and item["itemSet"]:
+            display["set"] = ImageTk.PhotoImage(image=Image.fromarray(item["itemSet"]["img"]))
+            display["set_slug"] = item["itemSet"]["slug"]
+
+        if "atk" in item:
+            text = f"Type d'arme : {item['atk']}"
+            passive = self.get_translation_of(item, "passive")
+            if passive and len(passive) > 0:
+                passive = passive.replace("^'s ", "").replace("^' ", "")
+                text = f"{text}\nPassif: {passive}\n"
+            active = self.get_translation_of(item, "active")
+            if active and len(active) > 0:
+                for a in active:
+                    text = f"{text}\nActif: {a['name']}\n"
+            display["variant"] = text
+
+        self.displays[key] = display
+        return display
+
+    def clear_cache(self):
+        """
+        Forgets the resolved texts and images, to be called when the items change.
+        """
+        self.evtQueue.put(self.displays.clear)
+        self.__wake()
+
+    def set_language(self, language, use_llm):
+        """
+        Switches the language of the next renders, the displays resolved in the previous one are forgotten.
+        """
+        def apply():
+            self.language = language
+            self.use_llm = use_llm
+            self.displays.clear()
+        self.evtQueue.put(apply)
+        self.__wake()
+
+    def __items(self, items, job_id=None):
+        if job_id is not None:
+            if job_id < self.displayed_job:
+                logging.info(f"Ignoring results of detection job {job_id}, job {self.displayed_job} is displayed")
+                return
+            self.displayed_job = job_id
+
+        with timings.span("render"):
+            self.__render(items)
+
+    def __render(self, items):
         self.__clear()
 
         if len(items) < 1:
@@ -89,92 +175,71 @@ class OverlayWindow(Tk):
             return
 
         for i, item in enumerate(items):
-            ttl_lbl = tk.Label(self.frame,
-                               text=self.get_translation_of(item, "name"),
-                               font=self.large_font,
-                               background=self.bgcolor,
-                               foreground=self.fgcolor,
-                               wraplength=self.column_size,
-                               justify="center")
-            ttl_lbl.grid(row=0, column=i)
-
-            tkimg = ImageTk.PhotoImage(image=Image.fromarray(cv.cvtColor(item["small-img"], cv.COLOR_RGB2BGR)))
-            img_lbl = tk.Label(self.frame, image=tkimg)
-            img_lbl.image = tkimg
-            img_lbl.grid(row=1, column=i)
-
-            dsc_lbl = tk.Label(self.frame,
-                               text=self.get_translation_of(item, "desc"),
-                               font=self.small_font,
-                               background=self.bgcolor,
-                               foreground=self.fgcolor,
-                               wraplength=self.column_size,
-                               justify="center")
-            dsc_lbl.grid(row=2, column=i)
-
-            if "itemSet" in item and item["itemSet"]:
-                tksetimg = ImageTk.PhotoImage(image=Image.fromarray(item["itemSet"]["img"]))
-                set_img_lbl = tk.Label(self.frame,
-                                       image=tksetimg,
-                                       text=item["itemSet"]["slug"],
-                                       font=self.small_font,
-                                       background=self.bgcolor,
-                                       foreground=self.fgcolor,
-                                       wraplength=self.column_size,
-                                       justify="center")
-                set_img_lbl.image = tksetimg
-                set_img_lbl.grid(row=3, column=i)
-
-            if "atk" in item:
-                text = f"Type d'arme : {item['atk']}"
-                passive = self.get_translation_of(item, "passive")
-                if passive and len(passive) > 0:
-                    passive = passive.replace("^'s ", "").replace("^' ", "")
-                    text = f"{text}\nPassif: {passive}\n"
-                active = self.get_translation_of(item, "active")
-                if active and len(active) > 0:
-                    for a in active:
-                        text = f"{text}\nActif: {a['name']}\n"
-
-                variant_lbl = tk.Label(self.frame,
-                                   text=text,
-                                   font=self.small_font,
-                                   background=self.bgcolor,
-                                   foreground=self.fgcolor,
-                                   wraplength=self.column_size,
-                                   justify="center")
-                variant_lbl.grid(row=4, column=i)
+            display = self.__display_of(item)
+            column = self.__column(i)
+
+            column["name"].configure(text=display["name"])
+            column["name"].grid(row=0, column=i)
+
+            column["img"].configure(image=display["img"])
+            column["img"].grid(row=1, column=i)
+
+            column["desc"].configure(text=display["desc"])
+            column["desc"].grid(row=2, column=i)
+
+            if display["set"] is not None:
+                column["set"].configure(image=display["set"], text=display["set_slug"])
+                column["set"].grid(row=3, column=i)
+
+            if display["variant"] is not None:
+                column["variant"].configure(text=display["variant"])
+                column["variant"].grid(row=4, column=i)
+
+        if self.show_timings:
+            # Debug row with the p50 / p95 / p99 of each stage, the current render not included
+            if self.timings_lbl is None:
+                self.timings_lbl = self.__label()
+            self.timings_lbl.configure(text=timings.TIMINGS.summary(), wraplength=self.column_size * len(items))
+            self.timings_lbl.grid(row=5, column=0, columnspan=len(items))
 
         self.pack()
         self.__position()
         self.lift()
 
-    def __check_queue(self):
-        try:
-            fct = self.evtQueue.get(block=False)
-        except queue.Empty:
-            self.after(self.check_interval, self.__check_queue)
-            return
-
-        logging.info(f"GUI event triggered : {fct}")
+    def __process_queue(self, event=None):
+        while True:
+            try:
+                fct = self.evtQueue.get(block=False)
+            except queue.Empty:
+                return
+
+            logging.info(f"GUI event triggered : {fct}")
+            try:
+                if fct is not None:
+                    fct()
+            except:
+                logging.exception("Event queue action failed !")
+
+    def __wake(self):
+        # Wakes the Tk loop up from any thread. Before the loop runs, events wait in the queue until run()
         try:
-            if fct is not None:
-                fct()
-        except:
-            logging.exception("Event queue action failed !")
-        self.after(self.check_interval, self.__check_queue)
+            self.event_generate(QUEUE_EVENT, when="tail")
+        except (RuntimeError, tk.TclError):
+            pass
 
     def __position(self):
         self.geometry('+%d+%d' % (0, 0))
 
     def set_message(self, message):
         self.evtQueue.put(lambda: self.__message(message))
+        self.__wake()
 
-    def set_items(self, items):
-        self.evtQueue.put(lambda: self.__items(items))
+    def set_items(self, items, job_id=None):
+        self.evtQueue.put(lambda: self.__items(items, job_id))
+        self.__wake()
 
     def run(self):
-        self.after(self.check_interval, self.__check_queue)
+        self.after_idle(self.__process_queue)
         self.mainloop()
 
     def pack(self):
@@ -0,0 +1,66 @@
+import logging
+import threading
+import typing
+
+import numpy as np
+
+
+class ColourPrefilter(object):
+    """
+    Shortlists the items whose colours can be found in the capture, so the search method only compares those.
+
+    Each item is described by the histogram of its masked pixels, quantized to a few levels per channel.
+    An item scores the share of its pixels whose colour bin is at least as populated in the capture, so an item
+    displayed on screen scores close to 1 whatever the background is.
+    Histograms are computed once for each item list (the item DB, or a set of templates scaled to a resolution).
+    """
+
+    def __init__(self, top_k: int = 40, levels: int = 8, gray_levels: int = 32):
+        self.top_k = top_k
+        self.levels = levels
+        self.gray_levels = gray_levels
+        self.lock = threading.Lock()
+        self._indexes = {}
+
+    def histogram(self, img: np.ndarray, mask: np.ndarray = None) -> np.ndarray:
+        if img.ndim < 3:
+            bins = (img.astype(np.uint16) * self.gray_levels) >> 8
+            size = self.gray_levels
+        else:
+            quantized = (img[:, :, :3].astype(np.uint16) * self.levels) >> 8
+            bins = (quantized[:, :, 0] * self.levels + quantized[:, :, 1]) * self.levels + quantized[:, :, 2]
+            size = self.levels ** 3
+        if mask is not None:
+            bins = bins[mask > 0]
+        return np.bincount(bins.ravel(), minlength=size).astype(np.float32)
+
+    def _index(self, items: typing.List[typing.Dict]) -> np.ndarray:
+        with self.lock:
+            index = self._indexes.get(id(items))
+            if index is None or index[0] is not items:
+                if len(self._indexes) >= 4:
+                    self._indexes = {}
+                index = (items, np.stack([self.histogram(item["img"], item["mask"]) for item in items]))
+                self._indexes[id(items)] = index
+                logging.info(f"Colour histograms computed for {len(items)} items")
+        return index[1]
+
+    def scores(self, screen: np.ndarray, items: typing.List[typing.Dict]) -> np.ndarray:
+        histograms = self._index(items)
+        found = np.minimum(histograms, self.histogram(screen)[None, :]).sum(axis=1)
+        return found / np.maximum(histograms.sum(axis=1), 1)
+
+    def ranking(self, screen: np.ndarray, items: typing.List[typing.Dict]) -> np.ndarray:
+        """
+        :return: The indexes of the items, from the best to the worst colour match.
+        """
+        return np.argsort(-self.scores(screen, items), kind="stable")
+
+    def shortlist(self, screen: np.ndarray, items: typing.List[typing.Dict]) -> typing.List[typing.Dict]:
+        """
+        :return: The top_k items that best match the screen colours, from best to worst.
+        """
+        if len(items) <= self.top_k:
+            return items
+
+        return [items[i] for i in self.ranking(screen, items)[:self.top_k]]
@@ -0,0 +1,155 @@
+import functools
+import logging
+import os
+import typing
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2 as cv
+import numpy as np
+from PIL import Image
+
+
+# Conversions of the BGR(A) arrays captured from the screen, giving the same result as the conversion of the RGB
+# image they represent. None means the array is already in the wanted format.
+ARRAY_CONVERSIONS = {
+    (4, cv.COLOR_BGR2RGB): cv.COLOR_BGRA2BGR,
+    (4, cv.COLOR_BGR2GRAY): cv.COLOR_RGBA2GRAY,
+    (3, cv.COLOR_BGR2RGB): None,
+    (3, cv.COLOR_BGR2GRAY): cv.COLOR_RGB2GRAY,
+}
+
+
+def img_convert(img: typing.Union[Image.Image, np.ndarray], color=cv.COLOR_BGR2GRAY):
+    """
+    Converts a PIL image, or a BGR or BGRA array as captured by OpenCV and mss, to an array.
+    """
+    if isinstance(img, np.ndarray):
+        channels = img.shape[2] if img.ndim > 2 else 1
+        if (channels, color) in ARRAY_CONVERSIONS:
+            conversion = ARRAY_CONVERSIONS[(channels, color)]
+            return img if conversion is None else cv.cvtColor(img, conversion)
+        img2 = cv.cvtColor(img, cv.COLOR_BGRA2RGB if channels == 4 else cv.COLOR_BGR2RGB)
+    else:
+        img2 = np.array(img.convert('RGB'))
+
+    if color is not None:
+        return cv.cvtColor(img2, color)
+    else:
+        return img2
+
+
+def nearest_indexes(size_in: int, size_out: int) -> np.ndarray:
+    """
+    :return: The source index of each output pixel of a PIL NEAREST resize. PIL starts half a step in and adds the
+    step once per pixel, the accumulated rounding errors choose the same pixels here.
+    """
+    step = size_in / size_out
+    positions = np.cumsum(np.concatenate(([step * 0.5], np.full(size_out - 1, step))))
+    return np.minimum(positions.astype(np.intp), size_in - 1)
+
+
+def resize_nearest(img: np.ndarray, size: typing.Tuple[int, int]) -> np.ndarray:
+    """
+    Resizes an array to size (w, h) picking the same pixels as the PIL NEAREST resampling.
+    """
+    return img.take(nearest_indexes(img.shape[0], size[1]), axis=0).take(nearest_indexes(img.shape[1], size[0]), axis=1)
+
+
+def mask(img: typing.Union[Image.Image, np.ndarray]):
+    if isinstance(img, Image.Image):
+        img = np.array(img.convert('RGBA'))
+    _, im_mask = cv.threshold(np.ascontiguousarray(img[:, :, 3]), 0, 255, cv.THRESH_BINARY)
+    return im_mask
+
+
+def make_transparent(img: Image) -> np.ndarray:
+    data = np.array(img.convert('RGBA'))
+    # On considere que le pixel en haut à gauche est transparent
+    background = np.all(data[:, :, :3] == data[0, 0, :3], axis=2)
+    data[background] = (255, 255, 255, 0)
+    return data
+
+
+def trim_to_alpha(data: np.ndarray) -> np.ndarray:
+    alpha = data[:, :, 3]
+    rows = np.flatnonzero(alpha.any(axis=1))
+    cols = np.flatnonzero(alpha.any(axis=0))
+    if len(rows) < 1:
+        return data
+    return data[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+
+
+class ImageFilter(object):
+    """
+    Converts a PIL image or a BGR(A) array to the array used for matching.
+    This is a class rather than a lambda so it can be sent to the preprocessing worker processes.
+    """
+
+    def __init__(self, gray=False, canny=False):
+        self.gray = gray
+        self.canny = canny
+
+    def __call__(self, img: typing.Union[Image.Image, np.ndarray]):
+        if self.canny:
+            return cv.Canny(img_convert(img, cv.COLOR_BGR2GRAY), 50, 200)
+        if self.gray:
+            return img_convert(img, cv.COLOR_BGR2GRAY)
+        return img_convert(img, cv.COLOR_BGR2RGB)
+
+    def __repr__(self):
+        return f"ImageFilter(gray={self.gray}, canny={self.canny})"
+
+
+def create_img_filter(gray=False, canny=False):
+    return ImageFilter(gray=gray, canny=canny)
+
+
+def preprocess_image(img_path: str, img_filter: typing.Callable, trim: bool, small_size_ratio: float) -> typing.Dict:
+    """
+    Builds the arrays of an item image : the filtered image and its mask used for matching,
+    and the small image displayed by the overlay.
+    """
+    data = make_transparent(Image.open(img_path))
+
+    if trim:
+        data = trim_to_alpha(data)
+
+    img = Image.fromarray(data, 'RGBA')
+    ih, iw = data.shape[0], data.shape[1]
+    small_shape = (int(round(iw * small_size_ratio)), int(round(ih * small_size_ratio)))
+
+    return {
+        "small-shape": small_shape,
+        "img": img_filter(img),
+        "mask": mask(data),
+        "small-img": img_convert(img.resize(small_shape), color=cv.COLOR_BGR2RGB),
+    }
+
+
+def preprocess_images(img_paths: typing.List[str],
+                      img_filter: typing.Callable,
+                      trim: bool,
+                      small_size_ratio: float,
+                      workers: int = 0,
+                      progress: typing.Callable[[int, int], typing.Any] = None) -> typing.List[typing.Dict]:
+    """
+    Preprocesses the images, in a pool of worker processes when there are enough of them.
+    :param workers: The number of processes to use. 0 uses one process per core, 1 disables the pool.
+    :param progress: Called with the number of images done and the total after each image.
+    """
+    job = functools.partial(preprocess_image, img_filter=img_filter, trim=trim, small_size_ratio=small_size_ratio)
+    workers = workers or os.cpu_count() or 1
+
+    if workers <= 1 or len(img_paths) < 2 * workers:
+        return [_report(progress, i, len(img_paths), job(img_path)) for i, img_path in enumerate(img_paths)]
+
+    logging.info(f"Preprocessing {len(img_paths)} images with {workers} processes")
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(job, img_paths, chunksize=max(1, len(img_paths) // (4 * workers)))
+        return [_report(progress, i, len(img_paths), result) for i, result in enumerate(results)]
+
+
+def _report(progress: typing.Optional[typing.Callable[[int, int], typing.Any]], i: int, total: int, result):
+    if progress is not None:
+        progress(i + 1, total)
+    return result
@@ -0,0 +1,102 @@
+import json
+import logging
+import os
+import typing
+
+# Settings a resolution profile overrides, the other ones come from the config
+PROFILE_KEYS = ["search_method", "use_sift", "use_colors", "prescale_templates"]
+
+
+def resolution_key(width: int, height: int) -> str:
+    return f"{width}x{height}"
+
+
+def read_profiles(path: str) -> typing.Dict[str, typing.Dict]:
+    """
+    :return: The profiles written by calibrate.py by resolution, empty if there are none.
+    """
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)["profiles"]
+    except (OSError, ValueError, KeyError) as e:
+        logging.warning(f"Ignoring unreadable resolution profiles {path} : {e}")
+        return {}
+
+
+def write_profiles(path: str, profiles: typing.Dict[str, typing.Dict]):
+    """
+    Saves the profiles, the ones of the other resolutions already saved are kept.
+    """
+    profiles = dict(read_profiles(path), **profiles)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        json.dump({"profiles": profiles}, f, indent=2)
+    os.replace(f"{path}.tmp", path)
+
+
+class ResolutionProfiles(object):
+    """
+    The detection pipelines of the resolutions calibrated by calibrate.py, built by build() on the loading thread
+    from the config and the settings of each profile. A pipeline shares the items of the default pipeline when
+    its profile keeps their filter, otherwise the items are loaded again with the profile filter, once for all the
+    profiles using it. The captures of a resolution whose pipeline is not built yet use the default one.
+    """
+
+    def __init__(self, config: typing.Dict, profiles: typing.Dict[str, typing.Dict], default: typing.Dict, cache=None):
+        """
+        :param default: The run_detection arguments used for the resolutions without profile.
+        :param cache: The item cache the default items were loaded with.
+        """
+        self.config = config
+        self.profiles = profiles
+        self.default = default
+        self.cache = cache
+        self.pipelines = {}
+
+    def pipeline(self, width: int, height: int) -> typing.Optional[typing.Dict]:
+        """
+        :return: The run_detection arguments of the resolution, None if it has no profile or if it is not built yet.
+        """
+        return self.pipelines.get(resolution_key(width, height))
+
+    def build(self):
+        """
+        Builds the pipelines of all the profiles. A profile that cannot be built is logged and skipped, its
+        resolution keeps the default pipeline.
+        """
+        catalogues = {self.config["use_colors"]: (self.default["item_db"], self.default["img_filter"], self.cache)}
+        for key, profile in sorted(self.profiles.items()):
+            try:
+                self.pipelines[key] = self._build(profile["settings"], catalogues)
+                logging.info(f"Using the {key} profile : {profile['settings']}")
+            except Exception:
+                logging.exception(f"Building the {key} profile failed, the default settings are used")
+
+    def _build(self, settings: typing.Dict, catalogues: typing.Dict[bool, typing.Tuple]) -> typing.Dict:
+        """
+        :param catalogues: The (item_db, img_filter, cache) already loaded by use_colors, the new ones are added.
+        """
+        from catalogue import create_item_cache, load_catalogue
+        from detector import create_search_method, prepare_search_method, search_priors
+        from loader import build_pipeline
+
+        config = dict(self.config, profiles_path="")
+        config.update({key: settings[key] for key in PROFILE_KEYS if key in settings})
+        if all(config[key] == self.config[key] for key in PROFILE_KEYS):
+            return self.default
+
+        if config["use_colors"] not in catalogues:
+            cache = create_item_cache(config)
+            item_db, img_filter = load_catalogue(config, cache)
+            catalogues[config["use_colors"]] = (item_db, img_filter, cache)
+        item_db, img_filter, cache = catalogues[config["use_colors"]]
+
+        if item_db is self.default["item_db"] and all(config[key] == self.config[key] for key in ["search_method", "use_sift"]):
+            search_method = self.default["search_method"]
+        else:
+            # The priors of the default pipeline are shared, the files they save are the same ones
+            search_method = create_search_method(config, search_priors(self.default["search_method"]))
+            prepare_search_method(search_method, item_db, cache)
+        return build_pipeline(config, item_db, img_filter, search_method)
@@ -0,0 +1,158 @@
+import logging
+import os
+import threading
+import time
+import typing
+
+from config import load_config
+from loader import CatalogueLoader, build_pipeline
+
+# Settings changing the preprocessing of every image, all the items are filtered again
+PREPROCESS_KEYS = {"use_colors", "trim_to_alpha", "small_size_ratio", "images_path", "cache_path"}
+# Settings changing which items are loaded or their texts, only the new items are preprocessed
+ITEM_KEYS = {"item_db", "limit_to_slugs", "language", "use_llm_translation", "compact_items"}
+# Settings of the search method, a new one is built on the same items
+SEARCH_KEYS = {"search_method", "use_sift", "matcher_threads", "frequency_cache_mb", "early_exit_confidence",
+               "pyramid_levels", "pyramid_candidates", "roi_prior_path", "roi_prior_min_hits",
+               "item_prior_path", "item_prior_margin", "item_prior_candidates"}
+TEMPLATE_KEYS = {"prescale_templates", "original_width"}
+PREFILTER_KEYS = {"use_prefilter", "prefilter_top_k"}
+# Settings applied on the fly, the others need a restart
+RELOADED_KEYS = PREPROCESS_KEYS | ITEM_KEYS | SEARCH_KEYS | TEMPLATE_KEYS | PREFILTER_KEYS \
+    | {"threshold", "detection_cache_size", "profiles_path"}
+
+
+class Reloader(object):
+    """
+    Watches the config, the item DB and the images folder, and applies their changes to the loaded catalogue.
+    Only the affected parts are rebuilt : a threshold change keeps the items and the search method caches, a new
+    slug only loads its own image, and a use_colors change filters the images again.
+    The new pipeline replaces the loader one in a single assignment, the detections already running keep theirs.
+    It comes with a new detection cache, the results found with the previous items or settings are dropped.
+    """
+
+    def __init__(self, loader: CatalogueLoader, config_path: str = "neondb/conf.js", interval: float = 1.0):
+        self.loader = loader
+        self.config_path = config_path
+        self.interval = interval
+        self.signature = None
+        self.loaded_at = None
+        # The last config read, the settings needing a restart are only reported once
+        self.config = None
+
+    def start(self):
+        thread = threading.Thread(target=self.run, name="reloader")
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    @staticmethod
+    def _mtime(path: str) -> float:
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            return 0
+
+    def _signature(self, config: typing.Dict) -> typing.Tuple[float, float, float, float]:
+        """
+        :return: The modification times of the config, of the item DB, of the most recent image and of the
+        resolution profiles.
+        """
+        images = [Reloader._mtime(config["images_path"])]
+        try:
+            with os.scandir(config["images_path"]) as entries:
+                images.extend(entry.stat().st_mtime for entry in entries if entry.is_file())
+        except OSError:
+            pass
+        return Reloader._mtime(self.config_path), Reloader._mtime(config["item_db"]), max(images), \
+            Reloader._mtime(config["profiles_path"])
+
+    def run(self):
+        self.loader.ready.wait()
+        if self.loader.pipeline is None:
+            return
+        self.config = self.loader.config
+        self.signature = self._signature(self.config)
+        self.loaded_at = time.time()
+        while True:
+            time.sleep(self.interval)
+            signature = self._signature(self.loader.config)
+            if signature == self.signature:
+                continue
+            try:
+                self.reload(signature)
+            except Exception:
+                logging.exception("Reloading the catalogue failed, the previous one is kept !")
+            self.signature = signature
+
+    def reload(self, signature: typing.Tuple[float, float, float, float]):
+        try:
+            config = load_config(self.config_path)
+        except ValueError as e:
+            # An editor may still be writing the file, it is read again on its next change
+            logging.warning(f"Ignoring unreadable config {self.config_path} : {e}")
+            return
+
+        from catalogue import create_item_cache, load_catalogue
+        from detector import create_search_method, prepare_search_method, search_priors, with_threshold
+        from siftindex import SiftIndex
+
+        old = self.loader.pipeline
+        changed = {key for key in set(config) | set(self.config) if config.get(key) != self.config.get(key)}
+        files_changed = signature[1:3] != self.signature[1:3]
+        profiles_changed = signature[3] != self.signature[3]
+        if len(changed - RELOADED_KEYS) > 0:
+            logging.warning(f"Settings {sorted(changed - RELOADED_KEYS)} are applied at the next start")
+        if len(changed & RELOADED_KEYS) < 1 and not files_changed and not profiles_changed:
+            self.config = config
+            return
+        logging.info(f"Reloading the catalogue, changed settings : {sorted(changed & RELOADED_KEYS)}")
+        started = time.perf_counter()
+        loaded_at = time.time()
+
+        cache = self.loader.cache
+        item_db, img_filter = old["item_db"], old["img_filter"]
+        items_changed = False
+        if len(changed & PREPROCESS_KEYS) > 0:
+            cache = create_item_cache(config)
+            item_db, img_filter = load_catalogue(config, cache)
+            items_changed = True
+        elif len(changed & ITEM_KEYS) > 0 or files_changed:
+            # Items whose image did not change since the last load keep their arrays
+            previous = {item["slug"]: item for item in item_db
+                        if Reloader._mtime(os.path.join(config["images_path"], f"{item['slug']}.png")) <= self.loaded_at}
+            item_db, img_filter = load_catalogue(config, cache, previous=previous)
+            items_changed = True
+
+        search_method = old["search_method"]
+        if len(changed & SEARCH_KEYS) > 0:
+            search_method = create_search_method(config, search_priors(old["search_method"]))
+            prepare_search_method(search_method, item_db, cache)
+        elif items_changed:
+            if isinstance(search_method, SiftIndex):
+                # The index is rebuilt from the descriptors kept by the items
+                search_method = SiftIndex()
+            prepare_search_method(search_method, item_db, cache)
+        if "threshold" in changed:
+            search_method = with_threshold(search_method, config["threshold"])
+
+        templates = old["templates"] if not items_changed and len(changed & TEMPLATE_KEYS) < 1 else None
+        prefilter = old["prefilter"] if len(changed & PREFILTER_KEYS) < 1 else None
+        pipeline = build_pipeline(config, item_db, img_filter, search_method, templates, prefilter, cache)
+        if pipeline["profiles"] is not None:
+            # Built before the new pipeline is used, the previous one keeps detecting meanwhile
+            pipeline["profiles"].build()
+
+        self.loader.cache = cache
+        self.loader.config = config
+        self.loader.pipeline = pipeline
+        self.config = config
+        self.loaded_at = loaded_at
+        logging.info(f"Catalogue reloaded in {time.perf_counter() - started:.2f} s, {len(item_db)} items")
+
+        window = self.loader.window
+        if window is not None:
+            if "language" in changed or "use_llm_translation" in changed:
+                window.set_language(config["language"], config["use_llm_translation"])
+            elif items_changed:
+                window.clear_cache()
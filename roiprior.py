@@ -0,0 +1,179 @@
+import json
+import logging
+import os
+import threading
+import typing
+
+import cv2 as cv
+import numpy as np
+
+from matcher import TemplateMatcher, rank_matches
+
+
+class RoiPrior(object):
+    """
+    Heatmaps of where the best matches were found on the large captures of each size, saved to a json file.
+    The screen is divided in cells of cell pixels, and each match heats the cells it covers.
+    """
+
+    def __init__(self, path: str = None, cell: int = 32, min_hits: int = 3, hot_ratio: float = 0.05):
+        """
+        :param min_hits: The number of matches recorded for a capture size before its windows are used.
+        :param hot_ratio: The share of the hottest cell heat a cell needs to be part of a window.
+        """
+        self.path = path
+        self.cell = cell
+        self.min_hits = min_hits
+        self.hot_ratio = hot_ratio
+        self.lock = threading.Lock()
+        self.heatmaps = {}
+        self.hits = {}
+        self._load()
+
+    @staticmethod
+    def key(shape: typing.Tuple) -> str:
+        return f"{shape[1]}x{shape[0]}"
+
+    def _load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data["cell"] != self.cell:
+                logging.info(f"ROI prior {self.path} has cells of {data['cell']} pixels, it will be rebuilt")
+                return
+            self.heatmaps = {key: np.array(heat, dtype=np.float32) for key, heat in data["heatmaps"].items()}
+            self.hits = data["hits"]
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logging.warning(f"Ignoring unreadable ROI prior {self.path} : {e}")
+            self.heatmaps = {}
+            self.hits = {}
+
+    def save(self):
+        if self.path is None:
+            return
+        with self.lock:
+            data = {
+                "cell": self.cell,
+                "heatmaps": {key: heat.tolist() for key, heat in self.heatmaps.items()},
+                "hits": dict(self.hits),
+            }
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(f"{self.path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(f"{self.path}.tmp", self.path)
+
+    def record(self, shape: typing.Tuple, top_left: typing.Tuple[int, int], size: typing.Tuple[int, int]):
+        """
+        Heats the cells covered by a match of size (w, h) at top_left, on a screen of this shape.
+        """
+        key = RoiPrior.key(shape)
+        with self.lock:
+            heat = self.heatmaps.get(key)
+            if heat is None:
+                heat = np.zeros((-(-shape[0] // self.cell), -(-shape[1] // self.cell)), dtype=np.float32)
+                self.heatmaps[key] = heat
+            x0, y0 = top_left[0] // self.cell, top_left[1] // self.cell
+            x1, y1 = (top_left[0] + size[0] - 1) // self.cell, (top_left[1] + size[1] - 1) // self.cell
+            heat[y0:y1 + 1, x0:x1 + 1] += 1
+            self.hits[key] = self.hits.get(key, 0) + 1
+
+    def windows(self, shape: typing.Tuple, margin: typing.Tuple[int, int]) -> typing.List[typing.Tuple[int, int, int, int]]:
+        """
+        :param margin: The (w, h) added around the hot cells, at least the size of the largest template.
+        :return: The (x0, y0, x1, y1) windows around the hot areas of the screen, hottest first.
+        Empty when not enough matches were recorded for this screen shape.
+        """
+        key = RoiPrior.key(shape)
+        with self.lock:
+            heat = self.heatmaps.get(key)
+            if heat is None or self.hits.get(key, 0) < self.min_hits:
+                return []
+            hot = (heat >= max(heat.max() * self.hot_ratio, 1e-6)).astype(np.uint8)
+
+        count, labels, stats, _ = cv.connectedComponentsWithStats(hot, connectivity=8)
+        windows = []
+        for label in range(1, count):
+            x, y, w, h = stats[label, :4]
+            windows.append((float(heat[labels == label].sum()), (
+                max(0, int(x * self.cell - margin[0])),
+                max(0, int(y * self.cell - margin[1])),
+                min(shape[1], int((x + w) * self.cell + margin[0])),
+                min(shape[0], int((y + h) * self.cell + margin[1])),
+            )))
+        windows = RoiPrior._merge(windows)
+        windows.sort(key=lambda w: w[0], reverse=True)
+        return [w[1] for w in windows]
+
+    @staticmethod
+    def _merge(windows: typing.List[typing.Tuple[float, typing.Tuple[int, int, int, int]]]) -> typing.List[typing.Tuple[float, typing.Tuple[int, int, int, int]]]:
+        """
+        Replaces the overlapping (heat, window) by the window bounding both with their summed heat, until no windows
+        overlap, so no area is searched twice.
+        """
+        windows = list(windows)
+        merged = True
+        while merged:
+            merged = False
+            for i in range(len(windows)):
+                for j in range(i + 1, len(windows)):
+                    (heat_a, a), (heat_b, b) = windows[i], windows[j]
+                    if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                        windows[i] = (heat_a + heat_b, (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])))
+                        del windows[j]
+                        merged = True
+                        break
+                if merged:
+                    break
+        return windows
+
+
+class RoiSearch(object):
+    """
+    Template search of the hot windows of large captures first, the full capture being searched only when no item
+    matches there above the threshold. The matches above the threshold are recorded in the prior.
+    Captures smaller than min_size pixels, like dragged regions, are searched as is.
+    """
+
+    def __init__(self, matcher: TemplateMatcher, prior: RoiPrior, min_size: int = 640 * 360):
+        self.matcher = matcher
+        self.prior = prior
+        self.min_size = min_size
+
+    def _search(self, screen, items: typing.List, cancel: threading.Event, search: typing.Dict) -> typing.List[typing.Tuple[float, typing.Dict, typing.Tuple[int, int]]]:
+        margin = (max(item["img"].shape[1] for item in items), max(item["img"].shape[0] for item in items))
+        windows = self.prior.windows(screen.shape, margin)
+        if len(windows) > 0:
+            best = {}
+            for x0, y0, x1, y1 in windows:
+                fitting = [item for item in items if item["img"].shape[0] <= y1 - y0 and item["img"].shape[1] <= x1 - x0]
+                for confidence, item, (x, y) in self.matcher.match_locations(screen[y0:y1, x0:x1], fitting, cancel, search):
+                    if item["slug"] not in best or confidence > best[item["slug"]][0]:
+                        best[item["slug"]] = (confidence, item, (x + x0, y + y0))
+
+            matches = list(best.values())
+            if any(m[0] > self.matcher.threshold for m in matches):
+                logging.info(f"Items found in {len(windows)} hot windows")
+                return matches
+            logging.info(f"No item found in {len(windows)} hot windows, searching the full screen")
+
+        return self.matcher.match_locations(screen, items, cancel, search)
+
+    def __call__(self, screen, items: typing.List, cancel: threading.Event = None):
+        if screen.shape[0] * screen.shape[1] < self.min_size:
+            return self.matcher(screen, items, cancel)
+
+        # The hot windows and the full screen searches make a single detection for the matcher stats and item prior
+        search = {}
+        matches = self._search(screen, items, cancel, search)
+        if cancel is not None and cancel.is_set():
+            return []
+        self.matcher.record_search(search, matches, cancel)
+
+        found = [m for m in matches if m[0] > self.matcher.threshold]
+        for confidence, item, top_left in found:
+            self.prior.record(screen.shape, top_left, (item["img"].shape[1], item["img"].shape[0]))
+        if len(found) > 0:
+            self.prior.save()
+        return rank_matches([(confidence, item) for confidence, item, _ in matches], self.matcher.threshold)
@@ -0,0 +1,66 @@
+import logging
+import threading
+import typing
+
+
+class DetectionJob(object):
+    def __init__(self, job_id: int, args: typing.Tuple):
+        self.id = job_id
+        self.args = args
+        self.cancelled = threading.Event()
+
+
+class DetectionScheduler(object):
+    """
+    Runs the detections on a dedicated worker thread, so the input listeners never wait for them.
+    Only the latest capture matters : a new job replaces the one still waiting, and cancels the one running unless
+    it is submitted with cancel_running=False, like the frames of the watch mode. These frames only replace the
+    waiting job, so a region changing faster than a detection takes still gets its detections done.
+    Job ids increase with each submission, so the overlay can ignore results older than the ones it displays.
+    """
+
+    def __init__(self, detect: typing.Callable[..., typing.Any]):
+        """
+        :param detect: Called on the worker thread with the job, followed by the submitted arguments.
+        """
+        self.detect = detect
+        self.condition = threading.Condition()
+        self.pending = None
+        self.running = None
+        self.last_id = 0
+
+    def start(self):
+        thread = threading.Thread(target=self.run, name="detection")
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def submit(self, *args, cancel_running: bool = True) -> int:
+        with self.condition:
+            self.last_id += 1
+            job = DetectionJob(self.last_id, args)
+            if self.pending is not None:
+                logging.info(f"Detection job {self.pending.id} superseded by job {job.id}")
+            if self.running is not None and cancel_running:
+                logging.info(f"Cancelling detection job {self.running.id}")
+                self.running.cancelled.set()
+            self.pending = job
+            self.condition.notify()
+        return job.id
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.pending is None:
+                    self.condition.wait()
+                job = self.pending
+                self.pending = None
+                self.running = job
+
+            try:
+                self.detect(job, *job.args)
+            except Exception:
+                logging.exception(f"Detection job {job.id} failed !")
+            finally:
+                with self.condition:
+                    self.running = None
@@ -2,24 +2,38 @@
 
 import logging
 import threading
+import time
 import typing
 
-from PIL import Image
+import numpy as np
 from mss import mss
 from pynput import keyboard, mouse
 from pynput.keyboard import KeyCode
 
+import timings
+
 
 class Screener(object):
-    def __init__(self, listener: typing.Callable[[Image], typing.NoReturn], pixel_sensibility=10, always_fullscreen=False, keep_last_region=False):
+    def __init__(self, listener: typing.Callable[[np.ndarray, int, int], typing.NoReturn], pixel_sensibility=10, always_fullscreen=False, keep_last_region=False,
+                 watch_fps=0, watch_region=None, watch_threshold=4.0,
+                 watch_listener: typing.Callable[[np.ndarray, int, int], typing.NoReturn] = None):
+        """
+        :param watch_listener: Called with the frames of the watched region, listener if None.
+        """
         self.mouse_pos = None
         self.press_start = None
         self.pixel_sensibility = pixel_sensibility
         self.last_region = None
         self.is_pressing = False
         self.listener = listener
+        self.watch_listener = watch_listener or listener
         self.always_fullscreen = always_fullscreen
         self.keep_last_region = keep_last_region
+        self.watch_fps = watch_fps
+        self.watch_region = watch_region
+        self.watch_threshold = watch_threshold
+        self.captured_region = None
+        self._local = threading.local()
 
     def run(self):
         with keyboard.Listener(on_press=self._on_press, on_release=self._on_release) as key_listener:
@@ -31,8 +45,72 @@ class Screener(object):
         thread = threading.Thread(target=self.run)
         thread.daemon = True
         thread.start()
+
+        if self.watch_fps > 0:
+            watcher = threading.Thread(target=self.watch)
+            watcher.daemon = True
+            watcher.start()
         return thread
 
+    @staticmethod
+    def _thumbnail(img: np.ndarray) -> np.ndarray:
+        h, w = img.shape[0], img.shape[1]
+        scale = min(1.0, 64 / max(w, h))
+        import cv2 as cv
+        gray = cv.cvtColor(img, cv.COLOR_BGRA2GRAY)
+        return cv.resize(gray, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv.INTER_AREA).astype(np.int16)
+
+    @staticmethod
+    def _difference(a: typing.Optional[np.ndarray], b: typing.Optional[np.ndarray]) -> float:
+        if a is None or b is None or a.shape != b.shape:
+            return float("inf")
+        return float(np.mean(np.abs(a - b)))
+
+    def watch(self):
+        """
+        Samples the watched region watch_fps times per second, and sends it to the watch listener when it differs
+        from the last frame sent, and has not changed since the previous sample (so animations are not sent half-way).
+        Frames are sent as they are sampled : a listener running detections in the background should keep only
+        the latest one, like DetectionScheduler does.
+        The watched region is watch_region, or else the last region captured via the keyboard.
+        """
+        period = 1.0 / self.watch_fps
+        previous = None
+        sent = None
+        while True:
+            start = time.monotonic()
+            region = self.watch_region or self.captured_region
+            if region is not None:
+                try:
+                    previous, sent = self._watch_frame(region, previous, sent)
+                except Exception:
+                    # The watcher keeps running, a monitor may have been unplugged or the listener failed
+                    logging.exception("Watching the region failed !")
+
+            time.sleep(max(0.0, period - (time.monotonic() - start)))
+
+    def _watch_frame(self, region: typing.Dict[str, int], previous: np.ndarray, sent: np.ndarray):
+        """
+        Samples the watched region once, and sends it to the watch listener if it changed.
+        :return: The thumbnails of the sampled frame and of the last frame sent.
+        """
+        screener = self._grabber()
+        sct_img = screener.grab(region)
+        img = np.frombuffer(sct_img.raw, dtype=np.uint8).reshape(sct_img.height, sct_img.width, 4)
+        thumbnail = Screener._thumbnail(img)
+
+        changed = Screener._difference(thumbnail, sent) > self.watch_threshold
+        stable = Screener._difference(thumbnail, previous) <= self.watch_threshold
+        if changed and stable and self.watch_listener is not None:
+            monitor = Screener._get_monitor_of(sct_img.left, sct_img.top, screener)
+            if monitor is None:
+                logging.debug(f"No monitor at {sct_img.left}, {sct_img.top}, frame skipped")
+                return thumbnail, sent
+            logging.debug("Watched region changed")
+            self.watch_listener(img, monitor["width"], monitor["height"])
+            sent = thumbnail
+        return thumbnail, sent
+
     @staticmethod
     def _get_full_display_size(screener: mss) -> typing.Dict[str, int]:
         monitors = screener
@@ -75,23 +153,34 @@ class Screener(object):
             "height": abs(self.mouse_pos[1] - self.press_start[1])\
             }
 
+    def _grabber(self) -> mss:
+        # mss handles belong to the thread that created them, so each thread keeps its own grabber open
+        grabber = getattr(self._local, "grabber", None)
+        if grabber is None:
+            grabber = mss()
+            self._local.grabber = grabber
+        return grabber
+
     def _do_screen(self):
-        with mss() as screener:
-            if self.always_fullscreen:
-                region = Screener._get_full_display_size(screener.monitors)
-            else:
-                region = self._get_screen_region(screener)
+        screener = self._grabber()
+        if self.always_fullscreen:
+            region = Screener._get_full_display_size(screener.monitors)
+        else:
+            region = self._get_screen_region(screener)
 
-            if self.keep_last_region:
-                self.last_region = region
+        if self.keep_last_region:
+            self.last_region = region
+        self.captured_region = region
 
+        with timings.span("capture"):
             sct_img = screener.grab(region)
-            img = Image.frombytes("RGB", sct_img.size, sct_img.bgra, "raw", "BGRX")
+            # A BGRA view of the captured buffer, without copy
+            img = np.frombuffer(sct_img.raw, dtype=np.uint8).reshape(sct_img.height, sct_img.width, 4)
             monitor = Screener._get_monitor_of(sct_img.left, sct_img.top, screener)
 
-            logging.debug("Image captured")
-            if self.listener is not None:
-                self.listener(img, monitor["width"], monitor["height"])
+        logging.debug("Image captured")
+        if self.listener is not None:
+            self.listener(img, monitor["width"], monitor["height"])
 
     def _on_press(self, key: KeyCode):
         if not self.is_pressing:
@@ -0,0 +1,93 @@
+import logging
+import threading
+import typing
+
+import cv2 as cv
+import numpy as np
+
+from itemcache import ItemCache
+
+
+class SiftIndex(object):
+    """
+    Searches items via SIFT features, with the descriptors of all the items computed once and put in a single
+    labelled FLANN index. Each descriptor of the screen votes for the item of its nearest neighbour, if it passes
+    the ratio test against the nearest neighbour belonging to another item.
+    Items with at least min_matches votes are returned, the best voted item if there are none.
+    """
+
+    def __init__(self, ratio: float = 0.75, min_matches: int = 8, neighbours: int = 4):
+        self.ratio = ratio
+        self.min_matches = min_matches
+        self.neighbours = neighbours
+        self.sift = cv.SIFT_create()
+        self.lock = threading.Lock()
+        self.slugs = []
+        self.labels = None
+        self.matcher = None
+
+    def describe(self, item: typing.Dict) -> np.ndarray:
+        if "sift" not in item:
+            _, descriptors = self.sift.detectAndCompute(item["img"], item["mask"])
+            item["sift"] = descriptors if descriptors is not None else np.zeros((0, 128), np.float32)
+        return item["sift"]
+
+    def build(self, items: typing.List[typing.Dict], cache: ItemCache = None):
+        """
+        Computes the descriptors missing from the items, and indexes all of them.
+        """
+        described = 0
+        for item in items:
+            if "sift" not in item:
+                self.describe(item)
+                described += 1
+                if cache is not None:
+                    cache.store(item)
+        if cache is not None:
+            cache.save()
+
+        descriptors = [item["sift"] for item in items]
+        self.slugs = [item["slug"] for item in items]
+        self.labels = np.concatenate([np.full(len(d), i, dtype=np.int32) for i, d in enumerate(descriptors)])
+        self.matcher = cv.FlannBasedMatcher(dict(algorithm=1, trees=5), dict(checks=50))
+        self.matcher.add([np.concatenate(descriptors).astype(np.float32)])
+        self.matcher.train()
+        logging.info(f"SIFT index built with {len(self.labels)} descriptors of {len(items)} items ({described} computed)")
+
+    def votes(self, screen) -> np.ndarray:
+        """
+        :return: The number of screen descriptors voting for each indexed item.
+        """
+        votes = np.zeros(len(self.slugs), dtype=np.int32)
+        _, descriptors = self.sift.detectAndCompute(screen, None)
+        if descriptors is None:
+            return votes
+
+        with self.lock:
+            matches = self.matcher.knnMatch(descriptors, k=self.neighbours)
+
+        for neighbours in matches:
+            if len(neighbours) < 2:
+                continue
+            label = self.labels[neighbours[0].trainIdx]
+            other = next((n for n in neighbours[1:] if self.labels[n.trainIdx] != label), neighbours[-1])
+            if neighbours[0].distance < self.ratio * other.distance:
+                votes[label] += 1
+        return votes
+
+    def __call__(self, screen, items: typing.List, cancel: threading.Event = None):
+        # A search is a single query, cancel is only accepted for compatibility with the other search methods
+        if self.matcher is None:
+            self.build(items)
+
+        # The items may be copies of the indexed ones, scaled to the screen resolution
+        by_slug = {item["slug"]: item for item in items}
+        votes = self.votes(screen)
+        ranked = [(int(votes[i]), by_slug[slug]) for i, slug in enumerate(self.slugs) if slug in by_slug]
+        ranked.sort(key=lambda r: r[0], reverse=True)
+        logging.info(f"SIFT votes : {[(r[1]['slug'], r[0]) for r in ranked[:5]]}")
+
+        results = [r[1] for r in ranked if r[0] >= self.min_matches]
+        if len(results) < 1:
+            results = [ranked[0][1]]
+        return results
@@ -0,0 +1,52 @@
+import logging
+import threading
+import typing
+
+import cv2 as cv
+
+
+class TemplateSets(object):
+    """
+    Item templates and masks scaled to the resolution of each monitor, so captures are matched at native scale
+    instead of being resized to the original_width reference. A set is built on the first detection at a
+    resolution, and kept until the item DB changes.
+    """
+
+    def __init__(self, original_width: int):
+        self.original_width = original_width
+        self.item_db = None
+        self.sets = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def scale_item(item: typing.Dict, scale: float) -> typing.Dict:
+        h, w = item["img"].shape[0], item["img"].shape[1]
+        size = (max(1, int(round(w * scale))), max(1, int(round(h * scale))))
+        # Area interpolation keeps the details of reduced templates, enlarged ones keep their crisp pixels.
+        interpolation = cv.INTER_AREA if scale < 1 else cv.INTER_NEAREST
+        scaled = dict(item)
+        scaled["img"] = cv.resize(item["img"], size, interpolation=interpolation)
+        scaled["mask"] = cv.resize(item["mask"], size, interpolation=cv.INTER_NEAREST)
+        return scaled
+
+    def get(self, item_db: typing.List[typing.Dict], resolution_width: int) -> typing.List[typing.Dict]:
+        if resolution_width == self.original_width:
+            return item_db
+
+        with self.lock:
+            if item_db is not self.item_db:
+                self.item_db = item_db
+                self.sets = {}
+
+            items = self.sets.get(resolution_width)
+            if items is None:
+                scale = resolution_width / self.original_width
+                logging.info(f"Scaling {len(item_db)} templates by {scale:.3f} for {resolution_width} pixels wide screens")
+                items = [TemplateSets.scale_item(item, scale) for item in item_db]
+                self.sets[resolution_width] = items
+        return items
+
+    def clear(self):
+        with self.lock:
+            self.item_db = None
+            self.sets = {}
@@ -0,0 +1,102 @@
+import os
+import unittest
+
+import cv2 as cv
+import numpy as np
+from PIL import Image
+
+from preprocess import create_img_filter, img_convert, preprocess_image, resize_nearest
+
+IMAGES_PATH = "neondb/images"
+
+
+# Reference copy of the per-pixel preprocessing the vectorized one replaced
+def reference_make_transparent(img: Image):
+    img = img.convert('RGBA')
+    data = img.getdata()
+    # On considere que le pixel en haut à gauche est transparent
+    firstpix = data[0]
+    new_data = []
+    for pix in data:
+        if pix[0] == firstpix[0] and pix[1] == firstpix[1] and pix[2] == firstpix[2]:
+            new_data.append((255, 255, 255, 0))
+        else:
+            new_data.append(pix)
+    img.putdata(new_data)
+    return img
+
+
+def reference_mask(img: Image):
+    _, im_mask = cv.threshold(np.array(img.convert('RGBA'))[:, :, 3], 0, 255, cv.THRESH_BINARY)
+    return im_mask
+
+
+def reference_filter(gray=False, canny=False):
+    if canny:
+        return lambda img: cv.Canny(img_convert(img, cv.COLOR_BGR2GRAY), 50, 200)
+    if gray:
+        return lambda img: img_convert(img, cv.COLOR_BGR2GRAY)
+    return lambda img: img_convert(img, cv.COLOR_BGR2RGB)
+
+
+def reference_preprocess(transparent: Image, img_filter, trim: bool, small_size_ratio: float):
+    img = transparent
+    if trim:
+        alpha = img.getchannel('A')
+        img = img.crop(alpha.getbbox())
+
+    iw, ih = img.size
+    small_shape = (int(round(iw * small_size_ratio)), int(round(ih * small_size_ratio)))
+    return {
+        "small-shape": small_shape,
+        "img": img_filter(img),
+        "mask": reference_mask(img),
+        "small-img": img_convert(img.resize(small_shape), color=cv.COLOR_BGR2RGB),
+    }
+
+
+class PreprocessTest(unittest.TestCase):
+    """
+    The vectorized preprocessing gives the same arrays as the per-pixel one, on every item image.
+    """
+
+    def test_same_as_per_pixel_preprocessing(self):
+        paths = sorted(os.path.join(IMAGES_PATH, f) for f in os.listdir(IMAGES_PATH)
+                       if f.endswith(".png") and not f.startswith("itemset-"))
+        if len(paths) < 1:
+            self.skipTest(f"No item image in {IMAGES_PATH}")
+
+        filters = {name: (create_img_filter(**kwargs), reference_filter(**kwargs))
+                   for name, kwargs in [("color", {}), ("gray", {"gray": True}), ("canny", {"canny": True})]}
+        for path in paths:
+            transparent = reference_make_transparent(Image.open(path))
+            for name, (img_filter, ref_filter) in filters.items():
+                for trim in [True, False]:
+                    with self.subTest(image=os.path.basename(path), filter=name, trim=trim):
+                        expected = reference_preprocess(transparent, ref_filter, trim, 0.7)
+                        result = preprocess_image(path, img_filter, trim, 0.7)
+                        self.assertEqual(expected["small-shape"], result["small-shape"])
+                        for key in ["img", "mask", "small-img"]:
+                            np.testing.assert_array_equal(expected[key], result[key], err_msg=key)
+
+
+class ResizeNearestTest(unittest.TestCase):
+    """
+    Captures resized to original_width pick the same pixels as the PIL NEAREST resampling.
+    """
+
+    def test_same_as_pil_nearest(self):
+        rng = np.random.default_rng(0)
+        for w, h in [(2560, 1440), (1280, 720), (3840, 2160), (1366, 768), (1600, 900), (3440, 1440), (533, 400), (266, 200)]:
+            screen = rng.integers(0, 256, (h, w, 3), dtype=np.uint8)
+            for original_width in [1920, 1000]:
+                # Sized like run_detection does
+                ratio = original_width / w
+                size = (int(w * ratio), int(h * ratio))
+                with self.subTest(screen=(w, h), size=size):
+                    expected = np.array(Image.fromarray(screen).resize(size, Image.Resampling.NEAREST))
+                    np.testing.assert_array_equal(expected, resize_nearest(screen, size))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+import os
+import unittest
+
+from benchmark import synthetic_screens
+from catalogue import load_catalogue
+from config import load_config
+from matcher import PyramidMatcher, TemplateMatcher
+
+IMAGES_PATH = "neondb/images"
+
+
+class PyramidTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # A few dozen items keep the exhaustive search fast
+        slugs = sorted(f[:-4] for f in os.listdir(IMAGES_PATH) if f.endswith(".png") and not f.startswith("itemset-"))[::12]
+        cls.config = dict(load_config("neondb/conf.js"), cache_path="", limit_to_slugs=slugs, preprocess_workers=1)
+        cls.item_db, cls.img_filter = load_catalogue(cls.config)
+
+    def test_same_top_item_as_exhaustive_search(self):
+        config = self.config
+        exhaustive = TemplateMatcher(config["threshold"], threads=1)
+        pyramid = PyramidMatcher(config["threshold"], threads=1, levels=config["pyramid_levels"],
+                                 candidates=config["pyramid_candidates"])
+        pyramid.prepare(self.item_db)
+
+        for slugs, screen in synthetic_screens(self.item_db, self.img_filter, IMAGES_PATH, 6, 2, (640, 360)):
+            with self.subTest(slugs=slugs):
+                confidences = {item["slug"]: confidence for confidence, item in exhaustive.match(screen, self.item_db)}
+                expected = max(confidences, key=confidences.get)
+                found = pyramid(screen, self.item_db)[0]["slug"]
+                # Items matching perfectly differ by the rounding errors of matchTemplate, which depend on the searched area
+                self.assertGreaterEqual(confidences[found], confidences[expected] - 1e-5, f"{found} instead of {expected}")
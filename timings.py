@@ -0,0 +1,97 @@
+import json
+import threading
+import time
+import typing
+from collections import deque
+from contextlib import nullcontext
+
+import numpy as np
+
+
+class _Span(object):
+    def __init__(self, timings: "Timings", stage: str):
+        self.timings = timings
+        self.stage = stage
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.timings.add(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+# Returned by the disabled spans, so they cost a call and nothing else
+_NO_SPAN = nullcontext()
+
+
+def percentiles(durations: typing.Iterable[float]) -> typing.Dict:
+    values = np.fromiter(durations, dtype=np.float64) * 1000
+    return {
+        "count": len(values),
+        "p50_ms": round(float(np.percentile(values, 50)), 2),
+        "p95_ms": round(float(np.percentile(values, 95)), 2),
+        "p99_ms": round(float(np.percentile(values, 99)), 2),
+    }
+
+
+class Timings(object):
+    """
+    Durations of the named stages of the detections, keeping the last window ones of each stage.
+
+        with timings.span("filter"):
+            screen = img_filter(scaled_screen)
+    """
+
+    def __init__(self, window: int = 256, enabled: bool = False):
+        self.window = window
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.durations = {}
+
+    def span(self, stage: str):
+        if not self.enabled:
+            return _NO_SPAN
+        return _Span(self, stage)
+
+    def add(self, stage: str, duration: float):
+        durations = self.durations.get(stage)
+        if durations is None:
+            with self.lock:
+                durations = self.durations.setdefault(stage, deque(maxlen=self.window))
+        durations.append(duration)
+
+    def reset(self):
+        with self.lock:
+            self.durations = {}
+
+    def report(self) -> typing.Dict[str, typing.Dict]:
+        """
+        :return: The count and the p50, p95 and p99 durations of each stage.
+        """
+        with self.lock:
+            stages = [(stage, list(durations)) for stage, durations in self.durations.items()]
+        return {stage: percentiles(durations) for stage, durations in stages if len(durations) > 0}
+
+    def summary(self) -> str:
+        return "\n".join(f"{stage} : {p['p50_ms']} / {p['p95_ms']} / {p['p99_ms']} ms" for stage, p in self.report().items())
+
+    def dump(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, indent=2)
+
+
+# The timings of the application, disabled unless enabled by the configuration
+TIMINGS = Timings()
+
+
+def span(stage: str):
+    return TIMINGS.span(stage)
+
+
+def enable(window: int = 256):
+    TIMINGS.window = window
+    TIMINGS.reset()
+    TIMINGS.enabled = True
@@ -1,13 +1,55 @@
+import json
 import logging
+import os
+import typing
+
 from transformers import AutoTokenizer, AutoModelForSeq2SeqLM, pipeline
 
+
+class TranslationMemory(object):
+    """
+    The translations already made, keyed by (source text, target language, model), appended to a JSON lines file
+    after each batch so an interrupted run keeps them.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Last line of an interrupted run
+                        continue
+                    self.entries[(entry["src"], entry["lang"], entry["model"])] = entry["text"]
+        logging.info(f"{len(self.entries)} translations found in memory {path}")
+
+    def get(self, text: str, lang: str, model: str) -> typing.Optional[str]:
+        return self.entries.get((text, lang, model))
+
+    def add(self, translations: typing.Dict[str, str], lang: str, model: str):
+        with open(self.path, "a", encoding="utf-8") as f:
+            for text, translation in translations.items():
+                self.entries[(text, lang, model)] = translation
+                f.write(json.dumps({"src": text, "lang": lang, "model": model, "text": translation}, ensure_ascii=False) + "\n")
+
+
 class Translator(object):
 
-    def __init__(self, model_name:str = "facebook/nllb-200-distilled-600M", src_lang: str = "eng_Latn", dst_lang: str = "fra_Latn", max_length=500):
+    def __init__(self, model_name:str = "facebook/nllb-200-distilled-600M", src_lang: str = "eng_Latn", dst_lang: str = "fra_Latn", max_length=500,
+                 batch_size: int = 16, memory_path: str = None):
+        """
+        :param dst_lang: The default target language, each call can translate to another one with the same model.
+        :param memory_path: The translation memory file, None to translate everything again.
+        """
         logging.info(f"Loading model {model_name} for {src_lang} -> {dst_lang} translations...")
         self.src_lang = src_lang
         self.dst_lang = dst_lang
         self.model_name = model_name
+        self.batch_size = batch_size
+        self.memory = TranslationMemory(memory_path) if memory_path else None
         self.tokenizer = AutoTokenizer.from_pretrained(model_name)
         self.model = AutoModelForSeq2SeqLM.from_pretrained(model_name)
         self.translator = pipeline("translation", \
@@ -36,5 +78,32 @@ class Translator(object):
         if lang == "zh":
             return "zho_Hans"
 
-    def translate(self, text) -> str:
-        return self.translator(text)[0]["translation_text"]
\ No newline at end of file
+    def translate(self, text, dst_lang: str = None) -> str:
+        return self.translate_batch([text], dst_lang)[0]
+
+    def translate_batch(self, texts: typing.List[str], dst_lang: str = None) -> typing.List[str]:
+        """
+        Translates the texts, each distinct text once. Texts found in the translation memory are not translated
+        again, the others are sorted by length so each pipeline batch pads them to similar sizes.
+        :param dst_lang: The NLLB target language, the default one if None.
+        :return: The translations, in the order of the texts.
+        """
+        dst_lang = dst_lang or self.dst_lang
+        translations = {}
+        for text in set(texts):
+            known = self.memory.get(text, dst_lang, self.model_name) if self.memory is not None else None
+            if known is not None:
+                translations[text] = known
+
+        missing = sorted({text for text in texts if text not in translations}, key=len)
+        if len(missing) > 0:
+            logging.info(f"Translating {len(missing)} texts to {dst_lang}, {len(translations)} found in memory")
+        for start in range(0, len(missing), self.batch_size):
+            batch = missing[start:start + self.batch_size]
+            results = self.translator(batch, src_lang=self.src_lang, tgt_lang=dst_lang, batch_size=self.batch_size)
+            batch_translations = {text: result["translation_text"] for text, result in zip(batch, results)}
+            translations.update(batch_translations)
+            if self.memory is not None:
+                self.memory.add(batch_translations, dst_lang, self.model_name)
+
+        return [translations[text] for text in texts]